@@ -0,0 +1,37 @@
+# Copyright 2020 Canonical Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Offline benchmarks of the charm hooks.
+
+They are not part of the tox environments, which are managed centrally;
+run them from the top of the repository with the test requirements
+installed:
+
+    python3 -m benchmarks [--iterations N] [--save-baseline]
+    python3 -m benchmarks.bench_config_snapshot
+    python3 -m benchmarks.bench_action_startup
+
+and check them with flake8 benchmarks.
+"""
+
+import sys
+
+sys.path.append("src")
+sys.path.append("src/lib")
+
+# Mock out charmhelpers so that the benchmarks run without a Juju
+# environment.
+import charms_openstack.test_mocks  # noqa
+
+charms_openstack.test_mocks.mock_charmhelpers()
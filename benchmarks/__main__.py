@@ -0,0 +1,93 @@
+# Copyright 2020 Canonical Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Run the hook benchmarks and compare them with a saved baseline.
+
+    python3 -m benchmarks [--iterations N] [--save-baseline]
+
+Results slower than the baseline by more than the threshold are reported
+as regressions and make the run fail. Baselines are only comparable on the
+machine they were recorded on, so record one before making changes.
+"""
+
+import argparse
+import json
+import os
+import platform
+import sys
+
+from benchmarks import bench_hooks
+
+DEFAULT_BASELINE = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "baseline.json")
+
+
+def _load(path):
+    try:
+        with open(path) as f:
+            return json.load(f)["results"]
+    except FileNotFoundError:
+        return None
+
+
+def _save(path, iterations, results):
+    with open(path, "w") as f:
+        json.dump({
+            "iterations": iterations,
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "results": results,
+        }, f, indent=2, sort_keys=True)
+        f.write("\n")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--iterations", type=int, default=100)
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE)
+    parser.add_argument("--save-baseline", action="store_true",
+                        help="record the results as the new baseline")
+    parser.add_argument("--threshold", type=float, default=0.25,
+                        help="relative slowdown reported as a regression")
+    args = parser.parse_args()
+
+    results = bench_hooks.run(args.iterations)
+    baseline = None if args.save_baseline else _load(args.baseline)
+    regressions = []
+    width = max(len(name) for name in results)
+    for name, elapsed in results.items():
+        line = "{:<{}} {:10.1f} us".format(name, width, elapsed)
+        if baseline and name in baseline:
+            change = elapsed / baseline[name] - 1
+            line += " {:+7.1%}".format(change)
+            if change > args.threshold:
+                line += " REGRESSION"
+                regressions.append(name)
+        print(line)
+
+    if args.save_baseline:
+        _save(args.baseline, args.iterations, results)
+        print("baseline saved to {}".format(args.baseline))
+    elif baseline is None:
+        print("no baseline at {}; record one with --save-baseline".format(
+            args.baseline))
+    if regressions:
+        print("{} regression(s) over {:.0%}".format(
+            len(regressions), args.threshold))
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
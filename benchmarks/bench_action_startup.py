@@ -0,0 +1,116 @@
+# Copyright 2020 Canonical Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Startup benchmark for the charm actions.
+
+Measures the wall-clock time from exec of a fresh interpreter to the
+completion of each action in actions.ACTIONS, plus an undefined action.
+The charm operations, Juju tools and the virtualenv bootstrap are stubbed
+so that the figures reflect import and dispatch overhead only.
+
+    python3 -m benchmarks.bench_action_startup [--iterations N]
+"""
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+import types
+
+import mock
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+UNDEFINED_ACTION = "undefined-action"
+
+CHARM_OPERATIONS = (
+    "create_trust",
+    "create_license",
+    "ghost_nfs_share",
+    "run_trilio_upgrade",
+    "_assess_status",
+)
+
+
+def _load_actions():
+    sys.path.append(os.path.join(ROOT, "src", "actions"))
+    import actions
+    return actions
+
+
+def _exec(action_name):
+    """Run a single action as the actions entry point would."""
+    layer = types.ModuleType("charms.layer")
+    layer.basic = types.ModuleType("charms.layer.basic")
+    layer.basic.bootstrap_charm_deps = layer.basic.init_config_states = (
+        lambda: None)
+    sys.modules["charms.layer"] = layer
+    sys.modules["charms.layer.basic"] = layer.basic
+
+    actions = _load_actions()
+    args = [os.path.join("actions", action_name)]
+    if action_name not in actions.ACTIONS:
+        actions.main(args)
+        return
+
+    # Patching by name imports the charm module as the action would.
+    base = "charm.openstack.trilio_wlm.TrilioWLMBaseCharm"
+    patches = [mock.patch("{}.{}".format(base, name))
+               for name in CHARM_OPERATIONS]
+    patches += [
+        mock.patch("charms.reactive.endpoint_from_name"),
+        mock.patch("charms.reactive.relations.endpoint_from_flag"),
+    ]
+    for patch in patches:
+        patch.start()
+    import charm.openstack.trilio_wlm as trilio_wlm
+    with mock.patch.object(
+            trilio_wlm.charms_openstack.charm, "get_charm_instance",
+            side_effect=trilio_wlm.TrilioWLMCharmUssuri42):
+        actions.main(args)
+
+
+def _run(action_name):
+    start = time.perf_counter()
+    subprocess.run(
+        [sys.executable, "-m", "benchmarks.bench_action_startup",
+         "--exec", action_name],
+        cwd=ROOT, check=True)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--iterations", type=int, default=10)
+    parser.add_argument("--exec", dest="action", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.action:
+        _exec(args.action)
+        return
+
+    start = time.perf_counter()
+    subprocess.run([sys.executable, "-c", "pass"], check=True)
+    print("{:<26} {:8.1f} ms".format(
+        "(interpreter)", (time.perf_counter() - start) * 1e3))
+    for action_name in list(_load_actions().ACTIONS) + [UNDEFINED_ACTION]:
+        timings = [_run(action_name) for _ in range(args.iterations)]
+        print("{:<26} {:8.1f} ms median {:8.1f} ms min".format(
+            action_name, statistics.median(timings) * 1e3,
+            min(timings) * 1e3))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+# Copyright 2020 Canonical Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Micro-benchmark for the per-hook configuration snapshot.
+
+Evaluates the charm properties consulted by render_with_interfaces and
+assess_status, once reusing the configuration snapshot for the whole
+render and once rebuilding it for every property evaluation (which is
+what each property did before the snapshot was introduced).
+
+    python3 -m benchmarks.bench_config_snapshot [--iterations N]
+"""
+
+import argparse
+import timeit
+
+import mock
+
+import charm.openstack.trilio_wlm as trilio_wlm
+
+CONFIG = {
+    "backup-target-type": "experimental-s3",
+    "nfs-shares": None,
+    "tv-s3-secret-key": "secret",
+    "tv-s3-access-key": "access",
+    "tv-s3-region-name": "RegionOne",
+    "tv-s3-bucket": "backups",
+    "tv-s3-endpoint-url": "http://s3.example.com",
+    "region": "RegionOne",
+}
+
+
+def _config(scope=None):
+    # Mirrors charmhelpers.core.hookenv.config once config-get has been
+    # cached for the hook.
+    if scope is not None:
+        return CONFIG.get(scope)
+    return CONFIG
+
+
+def _render(charm, invalidate):
+    """Evaluate the properties used while rendering configuration.
+
+    render_with_interfaces walks full_restart_map to checksum files
+    before and after rendering and to select the templates to render;
+    each template evaluates translated_backup_target_type; assess_status
+    then evaluates services and the custom status check.
+    """
+    evaluations = (
+        [lambda: charm.restart_map] * 3 +
+        [lambda: trilio_wlm.translated_backup_target_type(None)] * 4 +
+        [lambda: charm.packages,
+         lambda: charm.services,
+         charm.custom_assess_status_check])
+    for evaluate in evaluations:
+        if invalidate:
+            trilio_wlm.invalidate_config_snapshot()
+        evaluate()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--iterations", type=int, default=10000)
+    args = parser.parse_args()
+
+    with mock.patch.object(trilio_wlm.hookenv, "config", new=_config), \
+            mock.patch.object(trilio_wlm.reactive.flags, "is_flag_set",
+                              return_value=False):
+        charm = trilio_wlm.TrilioWLMCharmUssuri42()
+        results = {}
+        for label, invalidate in (("per-property", True),
+                                  ("snapshot", False)):
+            trilio_wlm.invalidate_config_snapshot()
+            elapsed = timeit.timeit(
+                lambda: _render(charm, invalidate), number=args.iterations)
+            results[label] = elapsed / args.iterations * 1e6
+            print("{:<14} {:8.2f} us/render".format(label, results[label]))
+    print("reduction      {:8.1f} %".format(
+        (1 - results["snapshot"] / results["per-property"]) * 100))
+
+
+if __name__ == "__main__":
+    main()
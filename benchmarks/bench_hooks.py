@@ -0,0 +1,76 @@
+# Copyright 2020 Canonical Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Benchmarks for the charm operations run by the hooks.
+
+Each charm class is exercised against fake relations with a varying number
+of cluster peers and endpoint catalog entries. Every iteration starts from
+a fresh configuration snapshot, as a new hook would.
+"""
+
+import collections
+import itertools
+import timeit
+
+import mock
+
+import charm.openstack.trilio_wlm as trilio_wlm
+
+from benchmarks import harness
+
+PEERS = (0, 2, 8)
+ENDPOINTS = (5, 50)
+
+
+def _operations(charm, interfaces):
+    hacluster = mock.MagicMock()
+    return collections.OrderedDict([
+        ("render_with_interfaces",
+         lambda: charm.render_with_interfaces(interfaces)),
+        ("assess_status", charm._assess_status),
+        ("restart_map", lambda: charm.restart_map),
+        ("services", lambda: charm.services),
+        ("configure_ha_resources",
+         lambda: charm.configure_ha_resources(hacluster)),
+    ])
+
+
+def run(iterations, peers=PEERS, endpoints=ENDPOINTS):
+    """Time the charm operations.
+
+    :param iterations: number of runs of each operation
+    :type iterations: int
+    :param peers: numbers of cluster peers to benchmark
+    :type peers: Iterable[int]
+    :param endpoints: endpoint catalog sizes to benchmark
+    :type endpoints: Iterable[int]
+    :returns: microseconds per run keyed by benchmark name
+    :rtype: Dict[str, float]
+    """
+    results = collections.OrderedDict()
+    for cls, n_peers, n_endpoints in itertools.product(
+            harness.charm_classes(), peers, endpoints):
+        with harness.environment(peers=n_peers):
+            charm = cls(release=cls.release)
+            interfaces = harness.relations(
+                peers=n_peers, endpoints=n_endpoints)
+            for name, operation in _operations(charm, interfaces).items():
+                def hook():
+                    trilio_wlm.invalidate_config_snapshot()
+                    operation()
+                elapsed = timeit.timeit(hook, number=iterations)
+                key = "{}.{}[peers={},endpoints={}]".format(
+                    cls.__name__, name, n_peers, n_endpoints)
+                results[key] = elapsed / iterations * 1e6
+    return results
@@ -0,0 +1,240 @@
+# Copyright 2020 Canonical Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Offline harness for exercising the charm classes without Juju.
+
+Provides fake identity-service, shared-db, amqp, cluster and hacluster
+relations, charm configuration read from config.yaml, and template
+rendering into a scratch directory instead of /etc.
+"""
+
+import contextlib
+import os
+import shutil
+import sys
+import tempfile
+
+import jinja2
+import mock
+import yaml
+
+import charm.openstack.trilio_wlm as trilio_wlm
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CHARM_DIR = os.path.join(ROOT, "src")
+TEMPLATES_DIR = os.path.join(CHARM_DIR, "templates")
+
+LOCAL_ADDRESS = "10.5.0.10"
+CATALOG_SERVICES = ("nova", "neutron", "glance", "cinderv3", "keystone")
+
+CONFIG_OVERRIDES = {
+    "openstack-origin": "cloud:bionic-ussuri",
+    "nfs-shares": "10.5.0.50:/srv/triliovault",
+    "vip": "10.5.0.100",
+    "region": "RegionOne",
+}
+
+
+def charm_config(**overrides):
+    """Return the charm configuration with the config.yaml defaults.
+
+    :rtype: Dict[str, Any]
+    """
+    with open(os.path.join(CHARM_DIR, "config.yaml")) as f:
+        options = yaml.safe_load(f)["options"]
+    config = {name: option.get("default") for name, option in options.items()}
+    config.update(CONFIG_OVERRIDES)
+    config.update(overrides)
+    return config
+
+
+class FakeRelation(object):
+    """Relation interface returning canned data from its accessors
+
+    Accessors without data return None, like an incomplete relation.
+    """
+
+    def __init__(self, name, **data):
+        self.relation_name = self.endpoint_name = name
+        self.auto_accessors = list(data)
+        self._data = data
+
+    def __getattr__(self, attr):
+        if attr.startswith("_"):
+            raise AttributeError(attr)
+        value = self._data.get(attr)
+        return lambda *args, **kwargs: value
+
+
+def endpoint_catalog(endpoints):
+    """Return an identity-service endpoint catalog.
+
+    :param endpoints: number of services in the catalog, at least the
+                      services used by the charm
+    :type endpoints: int
+    :rtype: Dict[str, Dict[str, str]]
+    """
+    names = list(CATALOG_SERVICES)
+    names += ["service{}".format(i) for i in range(endpoints - len(names))]
+    return {
+        name: {
+            interface: "http://10.5.1.{}:{}/v1".format(i % 250, 8000 + i)
+            for interface in trilio_wlm.ENDPOINT_INTERFACES
+        }
+        for i, name in enumerate(names)
+    }
+
+
+def relations(peers=0, endpoints=len(CATALOG_SERVICES)):
+    """Return fake relations for a complete deployment.
+
+    :param peers: number of cluster peers
+    :type peers: int
+    :param endpoints: number of services in the endpoint catalog
+    :type endpoints: int
+    :returns: identity-service, shared-db, amqp and cluster relations
+    :rtype: List[FakeRelation]
+    """
+    identity_service = FakeRelation(
+        "identity-service",
+        service_protocol="http",
+        service_host="10.5.0.2",
+        service_port="5000",
+        auth_protocol="http",
+        auth_host="10.5.0.2",
+        auth_port="35357",
+        api_version="3",
+        service_domain="service_domain",
+        service_domain_id="0d4d1e6f5d6b4d3e9c1e5b0f8a2c7d11",
+        service_username="trilio-wlm",
+        service_password="password",
+        service_tenant="services",
+        admin_user_id="b7a3c6e1e5f94c7f9a8e6f1f2c3d4e5f",
+        admin_domain_id="6c5b4a3928174e6d8c9b0a1f2e3d4c5b",
+        admin_project_id="1a2b3c4d5e6f47a8b9c0d1e2f3a4b5c6",
+        base_data_complete=True,
+        endpoint_checksums=endpoint_catalog(endpoints))
+    shared_db = FakeRelation(
+        "shared-db",
+        db_host="10.5.0.20",
+        username="workloadmgr",
+        password="password",
+        database="workloadmgr")
+    amqp = FakeRelation(
+        "amqp",
+        username="workloadmgr",
+        password="password",
+        vhost="openstack",
+        private_address="10.5.0.30",
+        rabbitmq_hosts=["10.5.0.30", "10.5.0.31", "10.5.0.32"])
+    cluster = FakeRelation(
+        "cluster",
+        ip_map=[("trilio-wlm/{}".format(i + 1), "10.5.0.{}".format(i + 11))
+                for i in range(peers)])
+    return [identity_service, shared_db, amqp, cluster]
+
+
+class _Renderer(object):
+    """Render templates from the charm into a scratch directory"""
+
+    def __init__(self, target_dir):
+        self.target_dir = target_dir
+        self.env = jinja2.Environment(
+            loader=jinja2.FileSystemLoader(TEMPLATES_DIR))
+
+    def __call__(self, source, target, context, *args, **kwargs):
+        content = self.env.get_template(source).render(context)
+        path = os.path.join(self.target_dir, os.path.basename(target))
+        with open(path, "w") as f:
+            f.write(content)
+        return content
+
+
+def _set_return_values(module_name, **values):
+    module = sys.modules.get(module_name)
+    if module is None:
+        return
+    for attr, value in values.items():
+        getattr(module, attr).return_value = value
+
+
+@contextlib.contextmanager
+def environment(peers=0, **config):
+    """Emulate a unit of a deployment with peers other units.
+
+    :param peers: number of cluster peers
+    :type peers: int
+    :param config: charm configuration overrides, with underscores for
+                   dashes
+    """
+    options = charm_config(
+        **{k.replace("_", "-"): v for k, v in config.items()})
+    target_dir = tempfile.mkdtemp()
+    _set_return_values(
+        "charmhelpers.contrib.network.ip",
+        get_relation_ip=LOCAL_ADDRESS,
+        get_address_in_network=LOCAL_ADDRESS,
+        is_ipv6=False,
+        format_ipv6_addr=None)
+    _set_return_values(
+        "charmhelpers.core.host",
+        get_total_ram=32 * 1024 ** 3,
+        service_running=True)
+    units = ["trilio-wlm/{}".format(i + 1) for i in range(peers)]
+    patches = [
+        mock.patch.object(
+            trilio_wlm.hookenv, "config",
+            new=lambda key=None: options if key is None else options.get(key)),
+        mock.patch.object(trilio_wlm.hookenv, "charm_dir",
+                          return_value=CHARM_DIR),
+        mock.patch.object(trilio_wlm.hookenv, "local_unit",
+                          return_value="trilio-wlm/0"),
+        mock.patch.object(trilio_wlm.hookenv, "service_name",
+                          return_value="trilio-wlm"),
+        mock.patch.object(trilio_wlm.hookenv, "unit_get",
+                          return_value=LOCAL_ADDRESS),
+        mock.patch.object(trilio_wlm.hookenv, "relation_ids",
+                          return_value=["cluster:1"]),
+        mock.patch.object(trilio_wlm.hookenv, "related_units",
+                          return_value=units),
+        mock.patch.object(trilio_wlm.ch_cluster, "peer_units",
+                          return_value=units),
+        mock.patch.object(trilio_wlm.reactive.flags, "is_flag_set",
+                          return_value=False),
+        mock.patch.object(sys.modules["charmhelpers.core.templating"],
+                          "render", new=_Renderer(target_dir)),
+    ]
+    for patch in patches:
+        patch.start()
+    trilio_wlm.invalidate_config_snapshot()
+    try:
+        yield target_dir
+    finally:
+        for patch in reversed(patches):
+            patch.stop()
+        trilio_wlm.invalidate_config_snapshot()
+        shutil.rmtree(target_dir)
+
+
+def charm_classes():
+    """Return the charm classes for each supported release.
+
+    :rtype: List[type]
+    """
+    return [
+        trilio_wlm.TrilioWLMCharmStein41,
+        trilio_wlm.TrilioWLMCharmStein42,
+        trilio_wlm.TrilioWLMCharmUssuri41,
+        trilio_wlm.TrilioWLMCharmUssuri42,
+    ]
@@ -13,46 +13,98 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import importlib
 import os
 import sys
+import time
 
 # Load modules from $CHARM_DIR/lib
 sys.path.append("lib")
 
-from charms.layer import basic
+# Only the modules needed by the requested action are imported, once the
+# action name has been validated, to keep action startup fast.
 
-basic.bootstrap_charm_deps()
-basic.init_config_states()
+# Modules registering hook start and exit callbacks when loaded, such as the
+# restart coordinator, imported before those callbacks are run.
+CALLBACK_MODULES = ("charm.openstack.trilio_wlm",)
 
-import charmhelpers.core.hookenv as hookenv
 
-import charms.reactive as reactive
+def _bootstrap():
+    """Activate the charm virtualenv and load charm states."""
+    from charms.layer import basic
 
-import charms_openstack.charm
-
-# import the trilio_wlm module to get the charm definitions created.
-import charm.openstack.trilio_wlm  # noqa
+    basic.bootstrap_charm_deps()
+    basic.init_config_states()
 
 
 def create_cloud_admin_trust(*args):
     """Create trust relation between Trilio WLM and Cloud Admin
     """
+    import charmhelpers.core.hookenv as hookenv
+    import charms.reactive as reactive
+    import charm.openstack.trilio_wlm as trilio_wlm
+
     cloud_admin_password = hookenv.action_get("password")
     identity_service = reactive.endpoint_from_name(
         "identity-service"
     )
-    with charms_openstack.charm.provide_charm_instance() as trilio_wlm_charm:
+    with trilio_wlm.provide_action_charm_instance() as trilio_wlm_charm:
         trilio_wlm_charm.create_trust(identity_service, cloud_admin_password)
         trilio_wlm_charm._assess_status()
 
 
+def benchmark_backup_target(*args):
+    """Measure the throughput and latency of the mounted backup targets.
+    """
+    import charmhelpers.core.hookenv as hookenv
+    import charm.openstack.benchmark as benchmark
+    import charm.openstack.trilio_wlm as trilio_wlm
+
+    options = benchmark.Options(
+        file_size=hookenv.action_get("file-size") * 1024 * 1024,
+        block_size=hookenv.action_get("block-size") * 1024,
+        random_block_size=hookenv.action_get("random-block-size") * 1024,
+        random_ops=hookenv.action_get("random-ops"),
+        metadata_files=hookenv.action_get("metadata-files"),
+        streams=hookenv.action_get("streams"))
+    with trilio_wlm.provide_action_charm_instance() as trilio_wlm_charm:
+        mounts = trilio_wlm_charm.backup_target_mounts()
+    if not mounts:
+        hookenv.action_fail("No backup target is mounted")
+        return
+    results = {}
+    failed = False
+    for i, (target, mountpoint) in enumerate(mounts.items()):
+        key = "target-{}".format(i)
+        results["{}.name".format(key)] = target
+        try:
+            tests = benchmark.run(mountpoint, options)
+        except OSError as e:
+            results["{}.error".format(key)] = str(e)
+            failed = True
+            continue
+        for test, result in tests.items():
+            prefix = "{}.{}".format(key, test)
+            if result.throughput is not None:
+                results[prefix + ".throughput-mbps"] = result.throughput
+            results[prefix + ".ops-per-sec"] = result.ops_per_sec
+            results[prefix + ".p50-ms"] = result.p50_ms
+            results[prefix + ".p99-ms"] = result.p99_ms
+    hookenv.action_set(results)
+    if failed:
+        hookenv.action_fail("Benchmark failed on some backup targets")
+
+
 def create_license(*args):
     """Create license for operation of TrilioVault
     """
+    import charms.reactive as reactive
+    import charm.openstack.trilio_wlm as trilio_wlm
+
     identity_service = reactive.endpoint_from_name(
         "identity-service"
     )
-    with charms_openstack.charm.provide_charm_instance() as trilio_wlm_charm:
+    with trilio_wlm.provide_action_charm_instance() as trilio_wlm_charm:
         trilio_wlm_charm.create_license(identity_service)
         trilio_wlm_charm._assess_status()
 
@@ -60,16 +112,36 @@ def create_license(*args):
 def ghost_share(*args):
     """Ghost mount secondard TV deployment nfs-share
     """
+    import charmhelpers.core.hookenv as hookenv
+    import charm.openstack.trilio_wlm as trilio_wlm
+
     secondary_nfs_share = hookenv.action_get("nfs-shares")
-    with charms_openstack.charm.provide_charm_instance() as trilio_wlm_charm:
-        trilio_wlm_charm.ghost_nfs_share(secondary_nfs_share)
+    with trilio_wlm.provide_action_charm_instance() as trilio_wlm_charm:
+        shares = trilio_wlm_charm.ghost_nfs_shares(
+            secondary_nfs_share, timeout=hookenv.action_get("timeout"))
+        results = {}
+        for i, (share, result) in enumerate(shares.items()):
+            results.update({
+                "share-{}.{}".format(i, key): value
+                for key, value in result.items()})
+            results["share-{}.ghost-share".format(i)] = share
+        hookenv.action_set(results)
         trilio_wlm_charm._assess_status()
+    failed = [share for share, result in shares.items()
+              if result["status"] in ("failed", "timeout")]
+    if failed:
+        hookenv.action_fail("Unable to ghost mount {}".format(
+            ", ".join(failed)))
 
 
 def update_trilio(*args):
     """Run setup after Trilio upgrade.
     """
-    with charms_openstack.charm.provide_charm_instance() as trilio_wlm_charm:
+    import charmhelpers.core.hookenv as hookenv
+    import charms.reactive as reactive
+    import charm.openstack.trilio_wlm as trilio_wlm
+
+    with trilio_wlm.provide_action_charm_instance() as trilio_wlm_charm:
         interfaces = ["shared-db", "amqp"]
         endpoints = [
             reactive.relations.endpoint_from_flag("{}.available".format(i))
@@ -77,33 +149,143 @@ def update_trilio(*args):
         # identity-service is of type reactive.Endpoint rather than
         # reactive.RelationBase and needs a different method to instantiate it.
         endpoints.append(reactive.endpoint_from_name("identity-service"))
-        trilio_wlm_charm.run_trilio_upgrade(endpoints)
+        prefetched, timings = trilio_wlm_charm.run_trilio_upgrade(endpoints)
+        trilio_wlm_charm._assess_status()
+    results = {"prefetched": prefetched}
+    results.update({
+        "timings.{}".format(phase): seconds
+        for phase, seconds in timings.items()})
+    hookenv.action_set(results)
+
+
+def nfs_client_tuning(*args):
+    """Report the host NFS client tuning in effect.
+    """
+    import charmhelpers.core.hookenv as hookenv
+    import charm.openstack.nfs as nfs
+    import charm.openstack.trilio_wlm as trilio_wlm
+
+    with trilio_wlm.provide_action_charm_instance() as trilio_wlm_charm:
+        state = trilio_wlm_charm.nfs_client_tuning_state()
+    results = {"enabled": state["enabled"]}
+    mismatched = []
+    for key, value in state["sysctl"].items():
+        results["sysctl.{}".format(
+            key.replace(".", "-").replace("_", "-"))] = (
+                "unknown" if value is None else value)
+        if value != nfs.CLIENT_SYSCTL[key]:
+            mismatched.append(key)
+    for share, read_ahead in state["read-ahead-kb"].items():
+        if read_ahead != nfs.CLIENT_READ_AHEAD_KB:
+            mismatched.append("{} read_ahead_kb".format(share))
+    results["read-ahead-kb"] = "\n".join(
+        "{}: {}".format(share, "unknown" if kb is None else kb)
+        for share, kb in state["read-ahead-kb"].items())
+    results["mismatched"] = ", ".join(mismatched)
+    hookenv.action_set(results)
+
+
+def prefetch_trilio_upgrade(*args):
+    """Download the packages of a Trilio upgrade ahead of update-trilio.
+    """
+    import charmhelpers.core.hookenv as hookenv
+    import charm.openstack.trilio_wlm as trilio_wlm
+
+    with trilio_wlm.provide_action_charm_instance() as trilio_wlm_charm:
+        prefetch = trilio_wlm_charm.prefetch_trilio_upgrade()
         trilio_wlm_charm._assess_status()
+    hookenv.action_set({
+        "downloaded": prefetch["downloaded"],
+        "seconds": prefetch["seconds"],
+        "packages": " ".join(prefetch["packages"]),
+    })
+
+
+def s3_cache_stats(*args):
+    """Report the usage and hit ratio of the S3 FUSE plugin cache.
+    """
+    import charmhelpers.core.hookenv as hookenv
+    import charm.openstack.trilio_wlm as trilio_wlm
+
+    snapshot = trilio_wlm.get_config_snapshot()
+    if snapshot.backup_target_type != "s3" or not snapshot.s3_cache_size:
+        hookenv.action_fail("S3 cache is not managed; set s3-cache-size")
+        return
+    stats = trilio_wlm.get_s3_cache_stats()
+    if not stats:
+        hookenv.action_fail("S3 cache has not been scanned yet")
+        return
+    # no hit ratio until objects have been requested between two scans, or
+    # while access times are not updated on every read
+    hit_ratio = stats["hit-ratio"]
+    hits, misses = stats.get("hits", 0), stats.get("misses", 0)
+    hookenv.action_set({
+        "hit-ratio": "unknown" if hit_ratio is None else hit_ratio,
+        "hits": "unknown" if hits is None else hits,
+        "misses": "unknown" if misses is None else misses,
+        "atime": stats.get("atime", "unknown"),
+        "objects": stats["objects"],
+        "size-mb": stats["size"] // (1024 * 1024),
+        "max-size-mb": snapshot.s3_cache_size,
+        "free-space-mb": trilio_wlm.get_free_space_mb(snapshot.s3_cache_dir),
+        "evicted-objects": stats["evicted-objects"],
+        "evicted-mb": stats["evicted-bytes"] // (1024 * 1024),
+        "scanned-at": time.strftime(
+            "%Y-%m-%dT%H:%M:%SZ", time.gmtime(stats["scanned-at"])),
+    })
+
+
+def guestfs_appliance_status(*args):
+    """Report the state of the prebuilt libguestfs appliance.
+    """
+    import charmhelpers.core.hookenv as hookenv
+    import charm.openstack.trilio_wlm as trilio_wlm
+
+    state = trilio_wlm.get_guestfs_appliance_state()
+    state.pop("dpkg-mtime", None)
+    hookenv.action_set({
+        k: "unknown" if v is None else v for k, v in state.items()})
 
 
 # Actions to function mapping, to allow for illegal python action names that
 # can map to a python function.
 ACTIONS = {
+    "benchmark-backup-target": benchmark_backup_target,
     "create-cloud-admin-trust": create_cloud_admin_trust,
     "create-license": create_license,
     "ghost-share": ghost_share,
+    "guestfs-appliance-status": guestfs_appliance_status,
+    "nfs-client-tuning": nfs_client_tuning,
+    "prefetch-trilio-upgrade": prefetch_trilio_upgrade,
+    "s3-cache-stats": s3_cache_stats,
     "update-trilio": update_trilio,
 }
 
 
 def main(args):
-    hookenv._run_atstart()
     action_name = os.path.basename(args[0])
     try:
         action = ACTIONS[action_name]
     except KeyError:
         return "Action %s undefined" % action_name
-    else:
-        try:
+    _bootstrap()
+    import charmhelpers.core.hookenv as hookenv
+    import charmhelpers.core.unitdata as unitdata
+    import charm.openstack.profiling as profiling
+
+    for module in CALLBACK_MODULES:
+        importlib.import_module(module)
+    hookenv._run_atstart()
+    profiling.enable(action_name)
+    try:
+        with profiling.section(action_name):
             action(args)
-        except Exception as e:
-            hookenv.function_fail(str(e))
+    except Exception as e:
+        hookenv.function_fail(str(e))
     hookenv._run_atexit()
+    # Persist flags and queued restarts, as the reactive framework does at
+    # the end of a hook.
+    unitdata.kv().flush()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,178 @@
+#!/usr/bin/env python3
+# Copyright 2020 Canonical Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Evict least recently used objects from the S3 FUSE plugin cache.
+
+Run periodically from cron by the trilio-wlm charm. Objects are evicted,
+oldest access first, once the cache exceeds its maximum size, until it is
+back under LOW_WATERMARK of that size. Cache statistics are accumulated in
+a JSON state file:
+
+- hits: cached objects read again since the previous run
+- misses: objects added to the cache since the previous run and read,
+  that is fetched from S3 for a read; objects written by backups and not
+  read back are not counted
+- atime: how the cache filesystem is mounted to update access times
+
+Access times are only reliable when the cache is mounted with strictatime,
+as the charm does; with relatime, the default, or noatime they are updated
+at most daily, or never, so hits and misses are recorded as unknown (null)
+and eviction falls back to the order objects were written or first read.
+
+Only the Python standard library is used as this runs outside the charm.
+"""
+
+import argparse
+import json
+import os
+import time
+
+LOW_WATERMARK = 0.9
+STRICTATIME = "strictatime"
+
+
+def _unescape(field):
+    # /proc/mounts escapes spaces, tabs, newlines and backslashes in octal
+    return field.encode().decode("unicode_escape")
+
+
+def atime_mode(path, mounts="/proc/self/mounts"):
+    """Return how the filesystem holding path updates access times.
+
+    :returns: strictatime, relatime or noatime
+    :rtype: str
+    """
+    path = os.path.realpath(path)
+    best, options = "", []
+    with open(mounts) as f:
+        for line in f:
+            fields = line.split()
+            mountpoint = _unescape(fields[1])
+            if (len(mountpoint) > len(best) and
+                    os.path.commonpath([path, mountpoint]) == mountpoint):
+                best, options = mountpoint, fields[3].split(",")
+    for mode in ("noatime", "relatime"):
+        if mode in options:
+            return mode
+    return STRICTATIME
+
+
+def scan(cache_dir):
+    """Return the cached objects.
+
+    :returns: (path, size, access time, modification time) for each object
+    :rtype: List[Tuple[str, int, float, float]]
+    """
+    entries = []
+    for root, _, files in os.walk(cache_dir):
+        for name in files:
+            path = os.path.join(root, name)
+            try:
+                st = os.lstat(path)
+            except FileNotFoundError:
+                continue
+            if not os.path.islink(path):
+                entries.append(
+                    (path, st.st_size, st.st_atime, st.st_mtime))
+    return entries
+
+
+def evict(entries, max_bytes):
+    """Remove least recently used objects until under the low watermark.
+
+    :returns: number of objects and bytes evicted
+    :rtype: Tuple[int, int]
+    """
+    total = sum(e[1] for e in entries)
+    if total <= max_bytes:
+        return 0, 0
+    target = max_bytes * LOW_WATERMARK
+    files = size = 0
+    for path, st_size, _, _ in sorted(
+            entries, key=lambda e: max(e[2], e[3])):
+        if total <= target:
+            break
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
+        total -= st_size
+        files += 1
+        size += st_size
+    return files, size
+
+
+def load_state(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return {}
+
+
+def save_state(path, state):
+    tmp = "{}.tmp".format(path)
+    with open(tmp, "w") as f:
+        json.dump(state, f, sort_keys=True)
+    os.rename(tmp, path)
+
+
+def run(cache_dir, max_bytes, state_file, now=None, atime=None):
+    """Update the cache statistics and evict objects over the maximum.
+
+    :param atime: atime mode of the cache, detected when not given
+    :returns: the updated statistics
+    :rtype: Dict
+    """
+    now = now or time.time()
+    atime = atime or atime_mode(cache_dir)
+    state = load_state(state_file)
+    previous = state.get("scanned-at")
+    entries = scan(cache_dir)
+    if atime != STRICTATIME:
+        state["hits"] = state["misses"] = None
+    elif previous:
+        if state.get("atime") != STRICTATIME:
+            # counted from now on
+            state["hits"] = state["misses"] = 0
+        state["hits"] = state.get("hits", 0) + sum(
+            1 for e in entries if e[3] <= previous < e[2])
+        state["misses"] = state.get("misses", 0) + sum(
+            1 for e in entries if previous < e[3] < e[2])
+    state["atime"] = atime
+    files, size = evict(entries, max_bytes)
+    state["evicted-objects"] = state.get("evicted-objects", 0) + files
+    state["evicted-bytes"] = state.get("evicted-bytes", 0) + size
+    state["objects"] = len(entries) - files
+    state["size"] = sum(e[1] for e in entries) - size
+    state["max-size"] = max_bytes
+    state["scanned-at"] = now
+    save_state(state_file, state)
+    return state
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--cache-dir", required=True)
+    parser.add_argument("--max-size", type=int, required=True,
+                        help="maximum cache size in MB")
+    parser.add_argument("--state-file", required=True)
+    args = parser.parse_args()
+    if os.path.isdir(args.cache_dir):
+        run(args.cache_dir, args.max_size * 1024 * 1024, args.state_file)
+
+
+if __name__ == "__main__":
+    main()
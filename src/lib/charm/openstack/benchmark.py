@@ -0,0 +1,244 @@
+# Copyright 2020 Canonical Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import collections
+import os
+import random
+import shutil
+import threading
+import time
+import typing
+
+# Directory created under the target for the benchmark files
+WORK_DIR = ".trilio-wlm-benchmark"
+
+
+class Options(typing.NamedTuple):
+    """Sizes and concurrency of a benchmark run"""
+
+    # size of the file written and read sequentially, and by each stream
+    file_size: int = 256 * 1024 * 1024
+    block_size: int = 1024 * 1024
+    random_block_size: int = 4096
+    random_ops: int = 1000
+    metadata_files: int = 500
+    streams: int = 4
+
+
+class Result(typing.NamedTuple):
+    """Throughput and per operation latency of a test"""
+
+    # MB/s, None for metadata operations
+    throughput: typing.Optional[float]
+    ops_per_sec: float
+    p50_ms: float
+    p99_ms: float
+
+
+def percentile(latencies, pct):
+    """Return a percentile of latencies by the nearest rank method.
+
+    :param latencies: sorted latencies
+    :type latencies: List[float]
+    :param pct: percentile, 0 to 100
+    :type pct: float
+    :rtype: float
+    """
+    if not latencies:
+        return 0.0
+    rank = max(int(round(pct / 100 * len(latencies))), 1)
+    return latencies[rank - 1]
+
+
+def _result(latencies, elapsed, nbytes=None):
+    latencies = sorted(latencies)
+    elapsed = max(elapsed, 1e-9)
+    return Result(
+        throughput=(None if nbytes is None
+                    else round(nbytes / elapsed / (1024 * 1024), 1)),
+        ops_per_sec=round(len(latencies) / elapsed, 1),
+        p50_ms=round(percentile(latencies, 50) * 1000, 3),
+        p99_ms=round(percentile(latencies, 99) * 1000, 3))
+
+
+def _drop_cache(fd):
+    """Ask the kernel to drop the cached pages of a file so that reads go
+    to the target.
+    """
+    if hasattr(os, "posix_fadvise"):
+        os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+
+
+def _write_file(path, size, block_size, latencies):
+    block = os.urandom(block_size)
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    try:
+        written = 0
+        while written < size:
+            started = time.perf_counter()
+            written += os.write(fd, block[:size - written])
+            latencies.append(time.perf_counter() - started)
+        os.fsync(fd)
+        _drop_cache(fd)
+    finally:
+        os.close(fd)
+    return written
+
+
+def sequential_write(path, options):
+    """Write a file in blocks of block_size."""
+    latencies = []
+    started = time.perf_counter()
+    written = _write_file(
+        path, options.file_size, options.block_size, latencies)
+    return _result(latencies, time.perf_counter() - started, written)
+
+
+def sequential_read(path, options):
+    """Read a file back in blocks of block_size."""
+    latencies = []
+    read = 0
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        started = time.perf_counter()
+        while True:
+            op_started = time.perf_counter()
+            data = os.read(fd, options.block_size)
+            latencies.append(time.perf_counter() - op_started)
+            if not data:
+                break
+            read += len(data)
+        elapsed = time.perf_counter() - started
+    finally:
+        os.close(fd)
+    return _result(latencies, elapsed, read)
+
+
+def _random_offsets(options):
+    blocks = max(options.file_size // options.random_block_size, 1)
+    return [random.randrange(blocks) * options.random_block_size
+            for _ in range(options.random_ops)]
+
+
+def random_read(path, options):
+    """Read blocks at random offsets of a file."""
+    latencies = []
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        _drop_cache(fd)
+        started = time.perf_counter()
+        for offset in _random_offsets(options):
+            op_started = time.perf_counter()
+            os.pread(fd, options.random_block_size, offset)
+            latencies.append(time.perf_counter() - op_started)
+        elapsed = time.perf_counter() - started
+    finally:
+        os.close(fd)
+    return _result(
+        latencies, elapsed, options.random_ops * options.random_block_size)
+
+
+def random_write(path, options):
+    """Write blocks at random offsets, each synced to the target as backup
+    metadata updates are.
+    """
+    latencies = []
+    block = os.urandom(options.random_block_size)
+    fd = os.open(path, os.O_WRONLY)
+    try:
+        started = time.perf_counter()
+        for offset in _random_offsets(options):
+            op_started = time.perf_counter()
+            os.pwrite(fd, block, offset)
+            os.fdatasync(fd)
+            latencies.append(time.perf_counter() - op_started)
+        elapsed = time.perf_counter() - started
+    finally:
+        os.close(fd)
+    return _result(
+        latencies, elapsed, options.random_ops * options.random_block_size)
+
+
+def metadata(directory, options):
+    """Create, stat and remove small files."""
+    latencies = []
+    paths = [os.path.join(directory, "meta-{}".format(i))
+             for i in range(options.metadata_files)]
+    started = time.perf_counter()
+    for op in (lambda p: os.close(os.open(p, os.O_WRONLY | os.O_CREAT)),
+               os.stat, os.unlink):
+        for path in paths:
+            op_started = time.perf_counter()
+            op(path)
+            latencies.append(time.perf_counter() - op_started)
+    return _result(latencies, time.perf_counter() - started)
+
+
+def parallel_write(directory, options):
+    """Write a file per stream concurrently."""
+    latencies = []
+    written = []
+    errors = []
+
+    def stream(i):
+        try:
+            written.append(_write_file(
+                os.path.join(directory, "stream-{}".format(i)),
+                options.file_size, options.block_size, latencies))
+        except OSError as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=stream, args=(i,))
+               for i in range(options.streams)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    if errors:
+        raise errors[0]
+    return _result(latencies, elapsed, sum(written))
+
+
+def run(target, options=None):
+    """Benchmark a backup target.
+
+    The files are written to a directory under target, which is removed
+    afterwards.
+
+    :param target: mounted backup target
+    :type target: str
+    :param options: sizes and concurrency, defaults to Options()
+    :type options: Optional[Options]
+    :returns: result of each test, keyed by test name
+    :rtype: collections.OrderedDict
+    :raises: OSError if the target is not writable
+    """
+    options = options or Options()
+    directory = os.path.join(target, WORK_DIR)
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, "sequential")
+    results = collections.OrderedDict()
+    try:
+        results["sequential-write"] = sequential_write(path, options)
+        results["sequential-read"] = sequential_read(path, options)
+        results["random-read"] = random_read(path, options)
+        results["random-write"] = random_write(path, options)
+        os.unlink(path)
+        results["metadata"] = metadata(directory, options)
+        results["parallel-write"] = parallel_write(directory, options)
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+    return results
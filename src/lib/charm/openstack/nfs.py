@@ -0,0 +1,302 @@
+# Copyright 2020 Canonical Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import collections
+import os
+
+import yaml
+
+# Directory the backup targets are mounted under, see vault_data_directory
+TV_MOUNTS = "/var/triliovault-mounts"
+
+# Named sets of mount options which can be used in place of options
+PROFILES = {
+    # Backup streams are mostly large sequential reads and writes; spread
+    # them over several connections with the largest transfer size.
+    "throughput": "nconnect=8,rsize=1048576,wsize=1048576,noatime",
+}
+
+# Mount options without a value; options in the same tuple are mutually
+# exclusive and the last one given wins.
+FLAG_OPTIONS = (
+    ("soft", "hard"),
+    ("intr", "nointr"),
+    ("ac", "noac"),
+    ("bg", "fg"),
+    ("lock", "nolock"),
+    ("cto", "nocto"),
+    ("acl", "noacl"),
+    ("sharecache", "nosharecache"),
+    ("resvport", "noresvport"),
+    ("fsc", "nofsc"),
+    ("rdirplus", "nordirplus"),
+    ("softreval", "nosoftreval"),
+    ("migration", "nomigration"),
+    ("tcp", "udp", "rdma"),
+    ("ro", "rw"),
+    ("sync", "async"),
+    ("atime", "noatime", "relatime", "strictatime"),
+    ("diratime", "nodiratime"),
+    ("exec", "noexec"),
+    ("suid", "nosuid"),
+    ("dev", "nodev"),
+    ("_netdev",),
+    ("sloppy",),
+)
+
+# Mount options with a value, mapped to their valid values; None accepts
+# any value.
+VALUE_OPTIONS = {
+    "timeo": int,
+    "retrans": int,
+    "rsize": int,
+    "wsize": int,
+    "acregmin": int,
+    "acregmax": int,
+    "acdirmin": int,
+    "acdirmax": int,
+    "actimeo": int,
+    "retry": int,
+    "nconnect": int,
+    "port": int,
+    "mountport": int,
+    "namlen": int,
+    "minorversion": int,
+    "vers": None,
+    "nfsvers": None,
+    "mountvers": None,
+    "proto": ("tcp", "tcp6", "udp", "udp6", "rdma", "rdma6"),
+    "mountproto": ("tcp", "tcp6", "udp", "udp6"),
+    "mounthost": None,
+    "clientaddr": None,
+    "sec": None,
+    "lookupcache": ("all", "none", "pos", "positive"),
+    "local_lock": ("none", "all", "flock", "posix"),
+}
+
+# Upper bound of nconnect enforced by the kernel
+MAX_NCONNECT = 16
+
+# Host NFS client tuning, applied when nfs-client-tuning is set: more RPC
+# slots to keep many requests in flight per connection, write-back of dirty
+# pages started early and capped so that it proceeds as a steady stream,
+# and TCP buffers large enough for 1MB rsize/wsize on fast links.
+CLIENT_SYSCTL = collections.OrderedDict([
+    ("sunrpc.tcp_slot_table_entries", "128"),
+    ("sunrpc.tcp_max_slot_table_entries", "128"),
+    ("vm.dirty_background_ratio", "5"),
+    ("vm.dirty_ratio", "10"),
+    ("net.core.rmem_max", "16777216"),
+    ("net.core.wmem_max", "16777216"),
+    ("net.ipv4.tcp_rmem", "4096 87380 16777216"),
+    ("net.ipv4.tcp_wmem", "4096 65536 16777216"),
+])
+# Read ahead of NFS mounts, set on their backing device info (BDI)
+CLIENT_READ_AHEAD_KB = 16384
+
+SYSCTL_CONF = "/etc/sysctl.d/50-trilio-wlm-nfs.conf"
+# sunrpc settings also applied when the module is loaded
+MODPROBE_CONF = "/etc/modprobe.d/trilio-wlm-nfs.conf"
+# Sets the read ahead of NFS mounts as they are mounted
+UDEV_RULES = "/etc/udev/rules.d/99-trilio-wlm-nfs.rules"
+
+_FLAG_GROUPS = {flag: group for group in FLAG_OPTIONS for flag in group}
+
+
+def parse_options(options):
+    """Parse a comma separated list of mount options.
+
+    Profile names are replaced by their options. When an option is given
+    more than once, or with a mutually exclusive flag, the last one wins.
+
+    :param options: mount options
+    :type options: str
+    :returns: option names and values, None for flags, keyed by option or
+              flag group
+    :rtype: collections.OrderedDict
+    """
+    parsed = collections.OrderedDict()
+    for option in (options or "").split(","):
+        option = option.strip()
+        if not option:
+            continue
+        if option in PROFILES:
+            parsed.update(parse_options(PROFILES[option]))
+            continue
+        name, _, value = option.partition("=")
+        key = _FLAG_GROUPS.get(name, name)
+        parsed.pop(key, None)
+        parsed[key] = (name, value if "=" in option else None)
+    return parsed
+
+
+def format_options(parsed):
+    """Format parsed mount options as a comma separated list.
+
+    :param parsed: options as returned by parse_options
+    :type parsed: collections.OrderedDict
+    :rtype: str
+    """
+    return ",".join(
+        name if value is None else "{}={}".format(name, value)
+        for name, value in parsed.values())
+
+
+def merge_options(*options):
+    """Merge mount options, later options taking precedence.
+
+    :param options: comma separated mount options
+    :type options: str
+    :rtype: str
+    """
+    parsed = collections.OrderedDict()
+    for _options in options:
+        for key, option in parse_options(_options).items():
+            parsed.pop(key, None)
+            parsed[key] = option
+    return format_options(parsed)
+
+
+def _option_error(name, value):
+    if name in _FLAG_GROUPS:
+        if value is not None:
+            return "{} takes no value".format(name)
+        return None
+    if name not in VALUE_OPTIONS:
+        return "unknown option {}".format(name)
+    valid = VALUE_OPTIONS[name]
+    if not value:
+        return "{} requires a value".format(name)
+    if valid is int:
+        if not value.isdigit():
+            return "{} must be an integer".format(name)
+        if name == "nconnect" and not 1 <= int(value) <= MAX_NCONNECT:
+            return "nconnect must be between 1 and {}".format(MAX_NCONNECT)
+    elif valid is not None and value not in valid:
+        return "{} must be one of {}".format(name, ", ".join(valid))
+    return None
+
+
+def validate_options(options):
+    """Check mount options are known and have valid values.
+
+    :param options: comma separated mount options
+    :type options: str
+    :returns: description of each invalid option
+    :rtype: List[str]
+    """
+    errors = (_option_error(name, value)
+              for name, value in parse_options(options).values())
+    return [e for e in errors if e]
+
+
+def valid_options(options):
+    """Return mount options without those which fail validation.
+
+    :param options: comma separated mount options
+    :type options: str
+    :rtype: str
+    """
+    return format_options(collections.OrderedDict(
+        (key, option) for key, option in parse_options(options).items()
+        if not _option_error(*option)))
+
+
+def parse_share_options(value):
+    """Parse the per share mount options configuration.
+
+    :param value: YAML mapping of NFS share to mount options
+    :type value: Optional[str]
+    :returns: mount options keyed by share
+    :rtype: Dict[str, str]
+    :raises: ValueError if the value is not a mapping of strings
+    """
+    if not value:
+        return {}
+    try:
+        shares = yaml.safe_load(value)
+    except yaml.YAMLError as e:
+        raise ValueError("not valid YAML: {}".format(e))
+    if not isinstance(shares, dict) or not all(
+            isinstance(k, str) and isinstance(v, str)
+            for k, v in shares.items()):
+        raise ValueError("not a mapping of share to mount options")
+    return shares
+
+
+def sysctl_conf():
+    """Return the sysctl.d configuration of the client tuning.
+
+    :rtype: str
+    """
+    return "".join(
+        "{} = {}\n".format(key, value)
+        for key, value in CLIENT_SYSCTL.items())
+
+
+def modprobe_conf():
+    """Return the modprobe.d configuration of the client tuning.
+
+    :rtype: str
+    """
+    return "options sunrpc {}\n".format(" ".join(
+        "{}={}".format(key.split(".", 1)[1], value)
+        for key, value in CLIENT_SYSCTL.items()
+        if key.startswith("sunrpc.")))
+
+
+def udev_rules():
+    """Return the udev rules setting the read ahead of NFS mounts.
+
+    NFS mounts have a BDI named after the device number of the mount, which
+    /proc/fs/nfsfs/volumes lists for each NFS volume.
+
+    :rtype: str
+    """
+    return (
+        'SUBSYSTEM=="bdi", ACTION=="add", '
+        'PROGRAM="/usr/bin/awk -v bdi=$kernel '
+        '\'BEGIN{{ret=1}} {{if ($4 == bdi) {{ret=0}}}} END{{exit ret}}\' '
+        '/proc/fs/nfsfs/volumes", ATTR{{read_ahead_kb}}="{}"\n'.format(
+            CLIENT_READ_AHEAD_KB))
+
+
+def read_ahead_path(path, sys_dir="/sys"):
+    """Return the read ahead setting of the BDI of a mounted filesystem.
+
+    :param path: mount point
+    :type path: str
+    :rtype: str
+    """
+    dev = os.stat(path).st_dev
+    return os.path.join(
+        sys_dir, "class", "bdi",
+        "{}:{}".format(os.major(dev), os.minor(dev)), "read_ahead_kb")
+
+
+def read_sysctl(key, proc_dir="/proc"):
+    """Return the current value of a kernel parameter.
+
+    :param key: parameter, for example vm.dirty_ratio
+    :type key: str
+    :returns: the value, with whitespace normalised, or None if the
+              parameter does not exist, as for an unloaded module
+    :rtype: Optional[str]
+    """
+    path = os.path.join(proc_dir, "sys", *key.split("."))
+    try:
+        with open(path) as f:
+            return " ".join(f.read().split())
+    except OSError:
+        return None
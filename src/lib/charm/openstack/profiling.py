@@ -0,0 +1,280 @@
+# Copyright 2020 Canonical Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Opt-in profiling of hooks and actions.
+
+When enabled with the profiling configuration option, or the
+TRILIO_WLM_PROFILE environment variable which takes precedence, every
+reactive handler and action is timed, along with the time it spends in
+relation reads, template rendering, package queries and subprocess calls.
+A breakdown is logged to juju-log when the hook or action exits. In
+cprofile mode a cProfile dump is also written to $CHARM_DIR/.profiles.
+"""
+
+import collections
+import contextlib
+import cProfile
+import functools
+import glob
+import importlib
+import os
+import time
+
+import charmhelpers.core.hookenv as hookenv
+
+ENV_VAR = "TRILIO_WLM_PROFILE"
+TIMING = "timing"
+CPROFILE = "cprofile"
+MODES = (TIMING, CPROFILE)
+
+PROFILES_DIR = ".profiles"
+# Number of cProfile dumps kept in PROFILES_DIR
+MAX_PROFILES = 20
+
+# Functions timed as phases, by module; calls made while already within a
+# phase are attributed to the outer phase.
+PHASES = collections.OrderedDict([
+    ("relation", [
+        ("charmhelpers.core.hookenv", "relation_get"),
+        ("charmhelpers.core.hookenv", "relation_set"),
+        ("charmhelpers.core.hookenv", "relation_ids"),
+        ("charmhelpers.core.hookenv", "related_units"),
+    ]),
+    ("template", [
+        ("charmhelpers.core.templating", "render"),
+    ]),
+    ("package", [
+        ("charmhelpers.fetch", "apt_install"),
+        ("charmhelpers.fetch", "filter_installed_packages"),
+        ("charmhelpers.contrib.openstack.utils", "get_os_codename_package"),
+        ("charm.openstack.trilio_wlm", "get_installed_version"),
+    ]),
+    ("subprocess", [
+        ("subprocess", "call"),
+        ("subprocess", "check_call"),
+        ("subprocess", "check_output"),
+        ("subprocess", "run"),
+    ]),
+])
+
+# Section accounting for time spent outside handlers and actions
+FRAMEWORK_SECTION = "(framework)"
+
+_profile = None
+
+
+def mode():
+    """Return the profiling mode requested for this unit.
+
+    :returns: one of MODES, or None if profiling is disabled
+    :rtype: Optional[str]
+    """
+    requested = os.environ.get(ENV_VAR)
+    if requested is None:
+        requested = hookenv.config("profiling")
+    if requested in MODES:
+        return requested
+    return None
+
+
+class Timing(object):
+    """Accumulated time and number of calls"""
+
+    def __init__(self):
+        self.elapsed = 0.0
+        self.calls = 0
+
+    def add(self, elapsed):
+        self.elapsed += elapsed
+        self.calls += 1
+
+
+class HookProfile(object):
+    """Timings for the sections and phases of a hook or action"""
+
+    def __init__(self, name, mode):
+        self.name = name
+        self.mode = mode
+        self.started = time.perf_counter()
+        self.sections = collections.OrderedDict()
+        self.phases = collections.defaultdict(
+            lambda: collections.defaultdict(Timing))
+        self._section = FRAMEWORK_SECTION
+        self._phase = None
+        self._patched = []
+        self._profiler = None
+
+    def start(self):
+        """Patch the phase functions and start cProfile if requested."""
+        for phase, targets in PHASES.items():
+            for module_name, attr in targets:
+                try:
+                    module = importlib.import_module(module_name)
+                    func = getattr(module, attr)
+                except (ImportError, AttributeError):
+                    continue
+                setattr(module, attr, self._timed_phase(phase, func))
+                self._patched.append((module, attr, func))
+        import charms.reactive.bus as bus
+        invoke = bus.Handler.invoke
+        self._patched.append((bus.Handler, "invoke", invoke))
+        profile = self
+
+        @functools.wraps(invoke)
+        def timed_invoke(handler):
+            with profile.section(handler.id()):
+                return invoke(handler)
+
+        bus.Handler.invoke = timed_invoke
+        if self.mode == CPROFILE:
+            self._profiler = cProfile.Profile()
+            self._profiler.enable()
+
+    def stop(self):
+        """Restore the phase functions and stop cProfile."""
+        if self._profiler:
+            self._profiler.disable()
+        for obj, attr, func in reversed(self._patched):
+            setattr(obj, attr, func)
+        self._patched = []
+
+    def _timed_phase(self, phase, func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if self._phase is not None:
+                return func(*args, **kwargs)
+            self._phase = phase
+            started = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self.phases[self._section][phase].add(
+                    time.perf_counter() - started)
+                self._phase = None
+        return wrapper
+
+    @contextlib.contextmanager
+    def section(self, name):
+        """Time a handler or action, attributing phases to it.
+
+        :param name: handler or action name
+        :type name: str
+        """
+        outer = self._section
+        self._section = name
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.sections.setdefault(name, Timing()).add(
+                time.perf_counter() - started)
+            self._section = outer
+
+    def summary(self):
+        """Return the breakdown of the hook, one line per section.
+
+        :rtype: List[str]
+        """
+        lines = ["profile {}: {:.3f}s".format(
+            self.name, time.perf_counter() - self.started)]
+        names = list(self.sections)
+        if FRAMEWORK_SECTION in self.phases:
+            names.append(FRAMEWORK_SECTION)
+        for name in names:
+            timing = self.sections.get(name)
+            line = "  {}".format(name)
+            if timing:
+                line += ": {:.3f}s".format(timing.elapsed)
+                if timing.calls > 1:
+                    line += " ({} calls)".format(timing.calls)
+            phases = [
+                "{} {:.3f}s/{}".format(phase, t.elapsed, t.calls)
+                for phase, t in self.phases[name].items()]
+            if phases:
+                line += " [{}]".format(", ".join(phases))
+            lines.append(line)
+        return lines
+
+    def dump(self, directory):
+        """Write the cProfile statistics to directory.
+
+        Only the most recent MAX_PROFILES dumps are kept.
+
+        :param directory: directory to write the dump to
+        :type directory: str
+        :returns: path to the dump
+        :rtype: str
+        """
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, "{}-{}.prof".format(
+            self.name, time.strftime("%Y%m%d%H%M%S")))
+        self._profiler.dump_stats(path)
+        dumps = sorted(
+            glob.glob(os.path.join(directory, "*.prof")),
+            key=os.path.getmtime)
+        for old in dumps[:-MAX_PROFILES]:
+            os.unlink(old)
+        return path
+
+
+def enable(name=None):
+    """Start profiling the current hook or action if requested.
+
+    The breakdown is logged, and any cProfile dump written, when the hook
+    or action runs its atexit callbacks.
+
+    :param name: hook or action name, defaults to the hook name
+    :type name: Optional[str]
+    :returns: the active profile or None if profiling is disabled
+    :rtype: Optional[HookProfile]
+    """
+    global _profile
+    if _profile is not None:
+        return _profile
+    requested = mode()
+    if requested is None:
+        return None
+    _profile = HookProfile(name or hookenv.hook_name(), requested)
+    _profile.start()
+    hookenv.atexit(disable)
+    return _profile
+
+
+def disable():
+    """Stop profiling and report the breakdown."""
+    global _profile
+    if _profile is None:
+        return
+    profile, _profile = _profile, None
+    profile.stop()
+    for line in profile.summary():
+        hookenv.log(line, level=hookenv.INFO)
+    if profile.mode == CPROFILE:
+        path = profile.dump(os.path.join(hookenv.charm_dir(), PROFILES_DIR))
+        hookenv.log("cProfile statistics written to {}".format(path),
+                    level=hookenv.INFO)
+
+
+@contextlib.contextmanager
+def section(name):
+    """Time a block as a section of the active profile, if any.
+
+    :param name: section name
+    :type name: str
+    """
+    if _profile is None:
+        yield
+    else:
+        with _profile.section(name):
+            yield
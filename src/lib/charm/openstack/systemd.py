@@ -0,0 +1,176 @@
+# Copyright 2020 Canonical Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import collections
+import re
+
+import yaml
+
+SYSTEMD_DIR = "/etc/systemd/system"
+
+# Resource control settings of the services, see systemd.resource-control(5).
+# wlm-api is weighted well above the data movers so that it stays responsive
+# while backups run; the data movers are throttled, rather than killed, as
+# they approach their share of memory. Throttling needs the memory controller
+# on the cgroup v2 unified hierarchy, see memory_controller_unified.
+DEFAULT_RESOURCES = collections.OrderedDict([
+    ("wlm-api", collections.OrderedDict([
+        ("CPUWeight", "1000"),
+        ("IOWeight", "1000"),
+        ("MemoryHigh", "infinity"),
+        ("MemoryMax", "infinity"),
+        ("TasksMax", "4096"),
+    ])),
+    ("wlm-workloads", collections.OrderedDict([
+        ("CPUWeight", "100"),
+        ("IOWeight", "100"),
+        ("MemoryHigh", "75%"),
+        ("MemoryMax", "infinity"),
+        ("TasksMax", "16384"),
+    ])),
+    ("tvault-object-store", collections.OrderedDict([
+        ("CPUWeight", "100"),
+        ("IOWeight", "100"),
+        ("MemoryHigh", "25%"),
+        ("MemoryMax", "infinity"),
+        ("TasksMax", "4096"),
+    ])),
+])
+
+# Valid range of the weights
+MIN_WEIGHT = 1
+MAX_WEIGHT = 10000
+
+# Lists the controllers of the cgroup v2 unified hierarchy when it is mounted
+# on /sys/fs/cgroup
+UNIFIED_CONTROLLERS = "/sys/fs/cgroup/cgroup.controllers"
+
+_SIZE_RE = re.compile(r"^(\d+[KMGT]?|\d+(\.\d+)?%|infinity)$")
+_TASKS_RE = re.compile(r"^(\d+|\d+(\.\d+)?%|infinity)$")
+
+
+def dropin(service):
+    """Return the path of the resource control drop-in of a service.
+
+    The file name includes the service as the charm templates are looked up
+    by file name.
+
+    :param service: systemd service name
+    :type service: str
+    :rtype: str
+    """
+    return "{0}/{1}.service.d/{1}-resources.conf".format(SYSTEMD_DIR, service)
+
+
+def parse_overrides(value):
+    """Parse the resource control overrides configuration.
+
+    :param value: YAML mapping of service to mapping of setting to value
+    :type value: Optional[str]
+    :returns: settings keyed by service
+    :rtype: Dict[str, Dict[str, str]]
+    :raises: ValueError if the value is not a mapping of service to mapping
+    """
+    if not value:
+        return {}
+    try:
+        overrides = yaml.safe_load(value)
+    except yaml.YAMLError as e:
+        raise ValueError("not valid YAML: {}".format(e))
+    if not isinstance(overrides, dict) or not all(
+            isinstance(k, str) and isinstance(v, dict)
+            for k, v in overrides.items()):
+        raise ValueError("not a mapping of service to settings")
+    return {
+        service: {str(k): str(v) for k, v in settings.items()}
+        for service, settings in overrides.items()}
+
+
+def validate_overrides(overrides):
+    """Check resource control overrides are known and have valid values.
+
+    :param overrides: settings keyed by service, see parse_overrides
+    :type overrides: Dict[str, Dict[str, str]]
+    :returns: description of each invalid override
+    :rtype: List[str]
+    """
+    errors = []
+    for service, settings in sorted(overrides.items()):
+        if service not in DEFAULT_RESOURCES:
+            errors.append("unknown service {}".format(service))
+            continue
+        for name, value in sorted(settings.items()):
+            if name in ("CPUWeight", "IOWeight"):
+                if (not value.isdigit() or
+                        not MIN_WEIGHT <= int(value) <= MAX_WEIGHT):
+                    errors.append(
+                        "{}: {} must be between {} and {}".format(
+                            service, name, MIN_WEIGHT, MAX_WEIGHT))
+            elif name in ("MemoryHigh", "MemoryMax"):
+                if not _SIZE_RE.match(value):
+                    errors.append(
+                        "{}: {} must be a size, percentage or "
+                        "infinity".format(service, name))
+            elif name == "TasksMax":
+                if not _TASKS_RE.match(value):
+                    errors.append(
+                        "{}: TasksMax must be a number, percentage or "
+                        "infinity".format(service))
+            else:
+                errors.append("{}: unknown setting {}".format(service, name))
+    return errors
+
+
+def resources(overrides):
+    """Merge resource control overrides with the defaults.
+
+    :param overrides: settings keyed by service, see parse_overrides
+    :type overrides: Dict[str, Dict[str, str]]
+    :returns: settings keyed by service
+    :rtype: collections.OrderedDict
+    """
+    merged = collections.OrderedDict()
+    for service, defaults in DEFAULT_RESOURCES.items():
+        merged[service] = collections.OrderedDict(defaults)
+        merged[service].update(overrides.get(service, {}))
+    return merged
+
+
+def memory_controller_unified(path=UNIFIED_CONTROLLERS):
+    """Whether memory is controlled through the cgroup v2 unified hierarchy.
+
+    bionic and focal default to the hybrid hierarchy, where memory is still
+    controlled through cgroup v1: MemoryMax is applied as the v1 memory
+    limit but MemoryHigh, which has no v1 equivalent, has no effect.
+
+    :param path: controllers of the unified hierarchy
+    :type path: str
+    :rtype: bool
+    """
+    try:
+        with open(path) as f:
+            return "memory" in f.read().split()
+    except OSError:
+        return False
+
+
+def throttled_services(resources):
+    """Return the services throttled by MemoryHigh.
+
+    :param resources: settings keyed by service, see resources
+    :type resources: Dict[str, Dict[str, str]]
+    :rtype: List[str]
+    """
+    return [service for service, settings in resources.items()
+            if settings.get("MemoryHigh", "infinity") != "infinity"]
@@ -13,11 +13,31 @@
 # limitations under the License.
 
 import collections
+import configparser
+import contextlib
 import copy
+import glob
+import hashlib
+import http.client
+import json
+import os
+import platform
+import re
+import shutil
 import subprocess
+import threading
+import time
+import typing
+import urllib.parse
+import weakref
 
 import charmhelpers.core.hookenv as hookenv
+import charmhelpers.core.host as ch_host
+import charmhelpers.core.unitdata as unitdata
+import charmhelpers.contrib.hahelpers.cluster as ch_cluster
 import charmhelpers.contrib.openstack.utils as os_utils
+import charmhelpers.fetch as fetch
+from charmhelpers import coordinator
 
 import charms_openstack.charm
 import charms_openstack.adapters
@@ -26,22 +46,1094 @@ import charms_openstack.ip as os_ip
 
 import charms.reactive as reactive
 
+import charm.openstack.nfs as nfs
+import charm.openstack.systemd as systemd
+import charm.openstack.workloadmgr_client as workloadmgr_client
+
 charms_openstack.plugins.trilio.make_trilio_handlers()
 
+ALEMBIC_VERSIONS_DIR = "/usr/share/workloadmgr/migrate_repo/versions"
+
+# Leader settings recording the state of the last database migration
+DB_SYNC_VERSION_KEY = "db-sync-pkg-version"
+DB_SYNC_REVISION_KEY = "db-sync-revision"
+DB_SYNC_SECONDS_KEY = "db-sync-seconds"
+# Set while the schema expected by the installed packages has not been
+# migrated by the leader; service restarts are held until it has.
+DB_SYNC_WAIT_FLAG = "trilio-wlm.db-sync-wait"
+
+RESTART_LOCK = "restart"
+RESTART_PENDING_FLAG = "restart.pending"
+# Unit data key holding services waiting for the restart lock
+PENDING_RESTARTS_KEY = "trilio-wlm.pending-restarts"
+API_WAIT_TIMEOUT = 300
+
+# Unit data key caching the last assessed workload status
+STATUS_CACHE_KEY = "trilio-wlm.status"
+# Set for the rest of an update-status hook which reused the cached status
+STATUS_CACHED_FLAG = "trilio-wlm.status-cached"
+
+# Unit data key recording the shares mounted by the charm and their options
+NFS_MOUNTS_KEY = "trilio-wlm.nfs-mounts"
+
+# Unit data key recording packages downloaded ahead of update-trilio
+UPGRADE_PREFETCH_KEY = "trilio-wlm.upgrade-prefetch"
+UPGRADE_DPKG_OPTS = [
+    "--option", "Dpkg::Options::=--force-confnew",
+    "--option", "Dpkg::Options::=--force-confdef",
+]
+
+# Seconds allowed for checking and bind mounting each ghost share
+GHOST_SHARE_TIMEOUT = 30
+
+# Unit data key caching the charm class resolved for actions
+CHARM_CLASS_KEY = "trilio-wlm.charm-class"
+DPKG_STATUS = "/var/lib/dpkg/status"
+
+# Fixed libguestfs appliance used by file search and restores, prebuilt so
+# that the first request after an install or kernel upgrade does not have
+# to build it; unit data records the kernel and libguestfs it was built for.
+GUESTFS_APPLIANCE_DIR = "/var/lib/trilio-wlm/guestfs-appliance"
+GUESTFS_APPLIANCE_KEY = "trilio-wlm.guestfs-appliance"
+# Unit data key recording a failed build, which is not retried until the
+# kernel or the installed packages change
+GUESTFS_APPLIANCE_FAILED_KEY = "trilio-wlm.guestfs-appliance-failed"
+GUESTFS_APPLIANCE_PACKAGE = "libguestfs0"
+GUESTFS_APPLIANCE_BUILD_TIMEOUT = 1800
+GUESTFS_APPLIANCE_DROPIN = os.path.join(
+    systemd.SYSTEMD_DIR, "wlm-workloads.service.d", "guestfs-appliance.conf")
+
+# Memory reserved for each wlm-workloads worker when sizing automatically;
+# the s3 target buffers snapshot data through the FUSE plugin.
+WORKLOADS_WORKER_MEMORY_MB = {
+    "nfs": 2048,
+    "s3": 4096,
+}
+
+# Bounds for the automatic sizing of the S3 FUSE plugin
+S3_MIN_UPLOAD_THREADS = 4
+S3_MAX_UPLOAD_THREADS = 32
+S3_MAX_READ_AHEAD = 8
+# Part size unless configured; all units writing to a bucket must use the
+# same size, so it does not depend on the host
+S3_DEFAULT_PART_SIZE_MB = 32
+# Share of host memory the plugin may hold in part buffers
+S3_BUFFER_MEMORY_FRACTION = 8
+
+# Cron job evicting objects from the S3 FUSE plugin cache, and the cache
+# statistics it records
+S3_CACHE_CRON = "/etc/cron.d/trilio-wlm-s3-cache"
+S3_CACHE_STATS = "/var/lib/trilio-wlm/s3-cache-stats.json"
+
+# File search processes may use up to a quarter of the host memory when
+# sized automatically, and at most half when configured explicitly.
+FILESEARCH_AUTO_MEMORY_FRACTION = 4
+FILESEARCH_MAX_MEMORY_FRACTION = 2
+# Smallest memory limit a search process, running a libguestfs appliance,
+# can work with
+FILESEARCH_MIN_MEMORY_MB = 512
+# I/O scheduling classes file search may run with, see ionice(1)
+FILESEARCH_IONICE_CLASSES = ("idle", "best-effort")
+FILESEARCH_IONICE = {"idle": 3, "best-effort": 2}
+# Hypervisor wrapper applying the file search limits to the libguestfs
+# appliances launched by wlm-workloads, see LIBGUESTFS_HV in guestfs(3),
+# and the lock files of the appliances running at once
+FILESEARCH_HV = "/usr/local/lib/trilio-wlm/filesearch-hv"
+FILESEARCH_LOCK_DIR = "/run/lock"
+# qemu system emulator suffix of machines not named after it
+QEMU_ARCHES = {"ppc64le": "ppc64", "armv7l": "arm"}
+
+# oslo.messaging notification drivers; noop disables notifications and an
+# empty value keeps the workloadmgr default.
+NOTIFICATION_DRIVERS = (
+    "", "messaging", "messagingv2", "routing", "log", "test", "noop")
+
+# Messaging configuration options, see invalid_messaging_options
+MESSAGING_OPTIONS = (
+    "rpc-response-timeout", "executor-thread-pool-size",
+    "rabbit-heartbeat-timeout-threshold", "rabbit-heartbeat-rate",
+    "notification-driver")
+
+# Minimum size of the RPC executor thread pool, the oslo.messaging default
+MIN_EXECUTOR_THREAD_POOL_SIZE = 64
+# RPC executor threads per wlm-workloads worker
+EXECUTOR_THREADS_PER_WORKER = 8
+
+# Unix socket of a mysql-router subordinate, keyed by application name
+MYSQL_ROUTER_SOCKET = "/var/lib/mysql/{}/mysql.sock"
+LOCAL_HOSTS = ("127.0.0.1", "localhost", "::1")
+
+_ALEMBIC_REVISION_RE = re.compile(
+    r"^(down_revision|revision)\s*(?::[^=]*)?=\s*(.+)$")
+
+
+def get_installed_version(package):
+    """Return the installed version of a package.
+
+    :param package: name of the package to query
+    :type package: str
+    :returns: installed version or None if not installed
+    :rtype: Optional[str]
+    """
+    try:
+        version = subprocess.check_output(
+            ["dpkg-query", "--show", "--showformat=${Version}", package],
+            stderr=subprocess.DEVNULL,
+            universal_newlines=True).strip()
+    except (subprocess.CalledProcessError, OSError):
+        return None
+    return version or None
 
-def _get_internal_url(identity_service, service):
-    ep_catalog = identity_service.relation.endpoint_checksums()
-    if service in ep_catalog:
-        return ep_catalog.get(service)["internal"]
+
+def db_sync_waiting():
+    """Whether service restarts are held until the leader has migrated the
+    database schema, see TrilioWLMBaseCharm.db_sync.
+
+    :rtype: bool
+    """
+    return reactive.is_flag_set(DB_SYNC_WAIT_FLAG)
+
+
+def get_alembic_head(versions_dir=ALEMBIC_VERSIONS_DIR):
+    """Determine the head revision of the installed schema migrations.
+
+    The migration scripts are scanned for their revision identifiers
+    rather than running 'alembic heads', which avoids starting a python
+    interpreter and loading alembic on every hook.
+
+    :param versions_dir: directory containing the migration scripts
+    :type versions_dir: str
+    :returns: head revision(s), comma separated, or None if no migrations
+              are found
+    :rtype: Optional[str]
+    """
+    revisions = set()
+    down_revisions = set()
+    for script in glob.glob(os.path.join(versions_dir, "*.py")):
+        with open(script, encoding="utf-8", errors="replace") as f:
+            for line in f:
+                match = _ALEMBIC_REVISION_RE.match(line)
+                if not match:
+                    continue
+                values = re.findall(r"['\"]([^'\"]+)['\"]", match.group(2))
+                if match.group(1) == "revision":
+                    revisions.update(values)
+                else:
+                    down_revisions.update(values)
+    heads = revisions - down_revisions
+    if not heads:
+        return None
+    return ",".join(sorted(heads))
+
+
+def read_config_options(path):
+    """Read the options set in an ini style configuration file.
+
+    :param path: configuration file to read
+    :type path: str
+    :returns: option values keyed by (section, option), or None if the file
+              does not exist or cannot be parsed
+    :rtype: Optional[Dict[Tuple[str, str], str]]
+    """
+    # Treat [DEFAULT] as a regular section rather than letting its options
+    # leak into every other section.
+    parser = configparser.ConfigParser(
+        interpolation=None, strict=False, default_section="charm:none")
+    parser.optionxform = str
+    try:
+        with open(path) as f:
+            parser.read_file(f)
+    except (OSError, configparser.Error):
+        return None
+    return {
+        (section, option): value
+        for section in parser.sections()
+        for option, value in parser.items(section)
+    }
+
+
+def changed_config_options(before, after):
+    """Return the options which differ between two configurations.
+
+    :param before: options as returned by read_config_options
+    :type before: Dict[Tuple[str, str], str]
+    :param after: options as returned by read_config_options
+    :type after: Dict[Tuple[str, str], str]
+    :returns: (section, option) pairs which were added, removed or changed
+    :rtype: Set[Tuple[str, str]]
+    """
+    return {
+        key for key in set(before) | set(after)
+        if before.get(key) != after.get(key)
+    }
+
+
+class TrilioWLMConfig(typing.NamedTuple):
+    """Immutable snapshot of the charm configuration.
+
+    Built once per hook by get_config_snapshot() and shared by the charm
+    class properties and the template adapters, so the backup target type
+    translation and option lookups are only done once per hook.
+    """
+
+    # backup-target-type translated to one of 'nfs', 's3' or 'UNKNOWN'
+    backup_target_type: str
+    # backup-target-type as rendered into vault_storage_type
+    storage_type: str
+    nfs_shares: typing.Optional[str]
+    nfs_options: typing.Optional[str]
+    nfs_share_options: typing.Optional[str]
+    nfs_client_tuning: bool
+    tv_s3_secret_key: typing.Optional[str]
+    tv_s3_access_key: typing.Optional[str]
+    tv_s3_region_name: typing.Optional[str]
+    tv_s3_bucket: typing.Optional[str]
+    tv_s3_endpoint_url: typing.Optional[str]
+    rolling_restart_concurrency: int
+    # 0 selects automatic sizing for the worker counts
+    api_workers: int
+    workloads_workers: int
+    max_api_workers: int
+    max_workloads_workers: int
+    worker_multiplier: typing.Optional[float]
+    # 0 leaves the pool sizes to oslo.db unless overridden
+    database_connection_budget: int
+    # None derives the pool size from the connection budget
+    database_max_pool_size: typing.Optional[int]
+    database_max_overflow: typing.Optional[int]
+    database_pool_timeout: int
+    database_connection_recycle_time: int
+    database_use_router_socket: bool
+    s3_part_size: int
+    s3_upload_threads: int
+    s3_read_ahead: int
+    s3_max_pool_connections: int
+    s3_max_retries: int
+    s3_cache_dir: str
+    # cache size in MB, 0 leaves the cache unmanaged
+    s3_cache_size: int
+    # 0 sizes the number of file search processes from the host
+    filesearch_max_processes: int
+    # memory limit of each file search process in MB, 0 for no limit
+    filesearch_memory_limit: int
+    filesearch_ionice_class: str
+    service_resource_overrides: typing.Optional[str]
+    rpc_response_timeout: int
+    # 0 sizes the executor thread pool from the workloads worker count
+    executor_thread_pool_size: int
+    rabbit_heartbeat_timeout_threshold: int
+    rabbit_heartbeat_rate: int
+    notification_driver: str
+
+    @classmethod
+    def from_config(cls, config):
+        """Build a snapshot from the charm configuration.
+
+        :param config: charm configuration
+        :type config: Dict[str, Any]
+        :rtype: TrilioWLMConfig
+        """
+        _type = (config.get("backup-target-type") or "").lower()
+        # The main purpose of this translation is to map experimental-s3
+        # to s3. This allows users who tried experimental-s3 a grace period
+        # before being pushed to s3.
+        if _type in ("experimental-s3", "s3"):
+            backup_target_type = "s3"
+        elif _type == "nfs":
+            backup_target_type = "nfs"
+        else:
+            backup_target_type = "UNKNOWN"
+        return cls(
+            backup_target_type=backup_target_type,
+            storage_type="s3" if _type == "experimental-s3" else _type,
+            nfs_shares=config.get("nfs-shares"),
+            nfs_options=config.get("nfs-options"),
+            nfs_share_options=config.get("nfs-share-options"),
+            nfs_client_tuning=bool(config.get("nfs-client-tuning")),
+            tv_s3_secret_key=config.get("tv-s3-secret-key"),
+            tv_s3_access_key=config.get("tv-s3-access-key"),
+            tv_s3_region_name=config.get("tv-s3-region-name"),
+            tv_s3_bucket=config.get("tv-s3-bucket"),
+            tv_s3_endpoint_url=config.get("tv-s3-endpoint-url"),
+            rolling_restart_concurrency=int(
+                config.get("rolling-restart-concurrency") or 0),
+            api_workers=int(config.get("api-workers") or 0),
+            workloads_workers=int(config.get("workloads-workers") or 0),
+            max_api_workers=int(config.get("max-api-workers") or 0),
+            max_workloads_workers=int(
+                config.get("max-workloads-workers") or 0),
+            worker_multiplier=(
+                None if config.get("worker-multiplier") is None
+                else float(config.get("worker-multiplier"))),
+            database_connection_budget=int(
+                config.get("database-connection-budget") or 0),
+            database_max_pool_size=(
+                None if config.get("database-max-pool-size") is None
+                else int(config.get("database-max-pool-size"))),
+            database_max_overflow=(
+                None if config.get("database-max-overflow") is None
+                else int(config.get("database-max-overflow"))),
+            database_pool_timeout=int(
+                config.get("database-pool-timeout") or 0),
+            database_connection_recycle_time=int(
+                config.get("database-connection-recycle-time") or 0),
+            database_use_router_socket=bool(
+                config.get("database-use-router-socket")),
+            s3_part_size=int(config.get("s3-part-size") or 0),
+            s3_upload_threads=int(config.get("s3-upload-threads") or 0),
+            s3_read_ahead=int(config.get("s3-read-ahead") or 0),
+            s3_max_pool_connections=int(
+                config.get("s3-max-pool-connections") or 0),
+            s3_max_retries=int(config.get("s3-max-retries") or 0),
+            s3_cache_dir=config.get("s3-cache-dir") or "",
+            s3_cache_size=int(config.get("s3-cache-size") or 0),
+            filesearch_max_processes=int(
+                config.get("filesearch-max-processes") or 0),
+            filesearch_memory_limit=int(
+                config.get("filesearch-memory-limit") or 0),
+            filesearch_ionice_class=(
+                config.get("filesearch-ionice-class") or "").strip(),
+            service_resource_overrides=config.get(
+                "service-resource-overrides"),
+            rpc_response_timeout=int(
+                config.get("rpc-response-timeout") or 0),
+            executor_thread_pool_size=int(
+                config.get("executor-thread-pool-size") or 0),
+            rabbit_heartbeat_timeout_threshold=int(
+                config.get("rabbit-heartbeat-timeout-threshold") or 0),
+            rabbit_heartbeat_rate=int(
+                config.get("rabbit-heartbeat-rate") or 0),
+            notification_driver=(
+                config.get("notification-driver") or "").strip(),
+        )
+
+    def unset_options(self, options):
+        """Return the configuration options which have no value.
+
+        :param options: charm configuration option names
+        :type options: List[str]
+        :rtype: List[str]
+        """
+        return [o for o in options if not getattr(self, o.replace("-", "_"))]
+
+    def invalid_messaging_options(self):
+        """Return the messaging configuration options with invalid values.
+
+        :rtype: List[str]
+        """
+        invalid = []
+        if self.rpc_response_timeout < 1:
+            invalid.append("rpc-response-timeout")
+        if self.executor_thread_pool_size < 0:
+            invalid.append("executor-thread-pool-size")
+        # heartbeats are disabled with a threshold of 0; otherwise the
+        # connection is checked heartbeat-rate times per threshold.
+        if self.rabbit_heartbeat_timeout_threshold < 0:
+            invalid.append("rabbit-heartbeat-timeout-threshold")
+        if self.rabbit_heartbeat_rate < 1:
+            invalid.append("rabbit-heartbeat-rate")
+        if self.notification_driver not in NOTIFICATION_DRIVERS:
+            invalid.append("notification-driver")
+        return invalid
+
+    def nfs_share_list(self):
+        """Return the configured NFS shares.
+
+        :rtype: List[str]
+        """
+        return [s.strip() for s in (self.nfs_shares or "").split(",")
+                if s.strip()]
+
+    def nfs_share_mount_options(self):
+        """Return the mount options of the shares with their own options.
+
+        Share options are applied on top of nfs-options. Options which fail
+        validation, and shares not in nfs-shares, are left out, see
+        nfs_option_errors.
+
+        :returns: mount options keyed by share
+        :rtype: Dict[str, str]
+        """
+        try:
+            share_options = nfs.parse_share_options(self.nfs_share_options)
+        except ValueError:
+            return {}
+        shares = self.nfs_share_list()
+        return {
+            share: nfs.merge_options(
+                nfs.valid_options(self.nfs_options),
+                nfs.valid_options(options))
+            for share, options in share_options.items() if share in shares}
+
+    def nfs_option_errors(self):
+        """Return the errors in the NFS mount options configuration.
+
+        :rtype: List[str]
+        """
+        errors = [
+            "nfs-options: {}".format(e)
+            for e in nfs.validate_options(self.nfs_options)]
+        try:
+            share_options = nfs.parse_share_options(self.nfs_share_options)
+        except ValueError as e:
+            return errors + ["nfs-share-options: {}".format(e)]
+        shares = self.nfs_share_list()
+        for share, options in sorted(share_options.items()):
+            if share not in shares:
+                errors.append(
+                    "nfs-share-options: {} not in nfs-shares".format(share))
+            errors.extend(
+                "nfs-share-options: {}: {}".format(share, e)
+                for e in nfs.validate_options(options))
+        return errors
+
+    def service_resource_errors(self):
+        """Return the errors in the service resource overrides.
+
+        :rtype: List[str]
+        """
+        try:
+            overrides = systemd.parse_overrides(
+                self.service_resource_overrides)
+        except ValueError as e:
+            return [str(e)]
+        return systemd.validate_overrides(overrides)
+
+    def service_resources(self):
+        """Return the resource control settings of the services.
+
+        Overrides are ignored while any of them is invalid.
+
+        :returns: systemd settings keyed by service
+        :rtype: collections.OrderedDict
+        """
+        overrides = {}
+        if not self.service_resource_errors():
+            overrides = systemd.parse_overrides(
+                self.service_resource_overrides)
+        return systemd.resources(overrides)
+
+
+_config_snapshot = None
+
+
+def get_config_snapshot():
+    """Return the configuration snapshot for the current hook.
+
+    :rtype: TrilioWLMConfig
+    """
+    global _config_snapshot
+    if _config_snapshot is None:
+        _config_snapshot = TrilioWLMConfig.from_config(hookenv.config())
+    return _config_snapshot
+
+
+def invalidate_config_snapshot():
+    """Discard the configuration snapshot so it is rebuilt on next use."""
+    global _config_snapshot
+    _config_snapshot = None
+
+
+# Endpoint catalog service names to look up, in order of preference
+ENDPOINT_SERVICE_NAMES = {
+    "cinder": ("cinderv2", "cinderv3", "cinder"),
+}
+
+ENDPOINT_INTERFACES = ("internal", "admin", "public")
+
+_endpoint_indexes = weakref.WeakKeyDictionary()
+
+
+def get_endpoint_index(identity_service):
+    """Return the identity-service endpoint catalog indexed by service and
+    interface.
+
+    The relation data is only read and parsed once for each adapter
+    instance; a new adapter instance is created for each render.
+
+    :param identity_service: identity-service relation adapter
+    :returns: endpoint URLs keyed by (service, interface)
+    :rtype: Dict[Tuple[str, str], str]
+    """
+    try:
+        return _endpoint_indexes[identity_service]
+    except KeyError:
+        pass
+    index = {}
+    ep_catalog = identity_service.relation.endpoint_checksums() or {}
+    for service, endpoints in ep_catalog.items():
+        for interface in ENDPOINT_INTERFACES:
+            url = endpoints.get(interface)
+            if url:
+                index[(service, interface)] = url
+    _endpoint_indexes[identity_service] = index
+    return index
+
+
+def get_endpoint_url(identity_service, service, interface="internal"):
+    """Return the endpoint URL of a service from the endpoint catalog.
+
+    :param identity_service: identity-service relation adapter
+    :param service: service name, see ENDPOINT_SERVICE_NAMES for services
+                    which are looked up under several catalog names
+    :type service: str
+    :param interface: one of ENDPOINT_INTERFACES
+    :type interface: str
+    :returns: endpoint URL or None if the service is not in the catalog
+    :rtype: Optional[str]
+    """
+    index = get_endpoint_index(identity_service)
+    for name in ENDPOINT_SERVICE_NAMES.get(service, (service,)):
+        url = index.get((name, interface))
+        if url:
+            return url
     return None
 
 
+class WorkerCounts(typing.NamedTuple):
+    """Number of worker processes for the workloadmgr services"""
+
+    api: int
+    workloads: int
+
+
+def get_worker_counts(cpus=None, memory_mb=None):
+    """Determine the number of wlm-api and wlm-workloads workers.
+
+    Explicitly configured counts are used as is. Otherwise wlm-api, a light
+    request/response service, gets a worker per CPU, and wlm-workloads,
+    whose jobs are bound by memory and I/O, gets a worker per CPU limited
+    by the memory each worker needs on the configured backup target. Both
+    are capped by max-api-workers and max-workloads-workers.
+
+    :param cpus: number of CPUs, defaults to the host CPU count
+    :type cpus: Optional[int]
+    :param memory_mb: memory in MB, defaults to the host total memory
+    :type memory_mb: Optional[int]
+    :rtype: WorkerCounts
+    """
+    snapshot = get_config_snapshot()
+    if cpus is None:
+        cpus = os.cpu_count() or 1
+    if memory_mb is None:
+        memory_mb = ch_host.get_total_ram() // (1024 * 1024)
+    if snapshot.worker_multiplier is not None:
+        cpus = int(cpus * snapshot.worker_multiplier)
+    cpus = max(cpus, 1)
+
+    api = snapshot.api_workers
+    if not api:
+        api = max(min(cpus, snapshot.max_api_workers or cpus), 1)
+
+    workloads = snapshot.workloads_workers
+    if not workloads:
+        worker_memory = WORKLOADS_WORKER_MEMORY_MB.get(
+            snapshot.backup_target_type, WORKLOADS_WORKER_MEMORY_MB["nfs"])
+        workloads = min(cpus, memory_mb // worker_memory)
+        if snapshot.max_workloads_workers:
+            workloads = min(workloads, snapshot.max_workloads_workers)
+        workloads = max(workloads, 1)
+    return WorkerCounts(api=api, workloads=workloads)
+
+
+class DatabasePool(typing.NamedTuple):
+    """oslo.db connection pool settings for each workloadmgr process"""
+
+    # None for the oslo.db default
+    max_pool_size: typing.Optional[int]
+    max_overflow: typing.Optional[int]
+    pool_timeout: int
+    connection_recycle_time: int
+
+
+def get_database_pool():
+    """Determine the database connection pool settings.
+
+    Unless database-connection-budget is set, the pool sizes are left to
+    oslo.db. The budget of the unit is shared evenly between every process
+    holding a connection pool: the wlm-api and wlm-workloads workers plus
+    their parents, wlm-scheduler and wlm-cron each open their own pool.
+    Each process gets a pool of half its share, and may overflow up to the
+    rest of it, so the unit never opens more connections than the budget.
+    database-max-pool-size and database-max-overflow override the derived
+    values.
+
+    :rtype: DatabasePool
+    """
+    snapshot = get_config_snapshot()
+    max_pool_size = snapshot.database_max_pool_size
+    max_overflow = snapshot.database_max_overflow
+    budget = snapshot.database_connection_budget
+    if budget:
+        workers = get_worker_counts()
+        # one parent process per forking service plus wlm-scheduler and
+        # wlm-cron
+        processes = workers.api + workers.workloads + 4
+        share = budget // processes
+        if share < 1:
+            hookenv.log(
+                "database-connection-budget {} is too small for {} "
+                "processes".format(budget, processes),
+                level=hookenv.WARNING)
+        if max_pool_size is None:
+            max_pool_size = max(share // 2, 1)
+        if max_overflow is None:
+            max_overflow = max(share - max_pool_size, 0)
+    return DatabasePool(
+        max_pool_size=max_pool_size,
+        max_overflow=max_overflow,
+        pool_timeout=snapshot.database_pool_timeout,
+        connection_recycle_time=snapshot.database_connection_recycle_time)
+
+
+class S3Tuning(typing.NamedTuple):
+    """Transfer settings for the S3 FUSE plugin"""
+
+    # size of the segments objects are stored in, in bytes
+    part_size: int
+    upload_threads: int
+    # number of segments read ahead and cached
+    read_ahead: int
+    max_pool_connections: int
+    max_retries: int
+
+
+def get_s3_tuning(cpus=None, memory_mb=None):
+    """Determine the transfer settings of the S3 FUSE plugin.
+
+    Options set to 0 are sized from the host: two upload threads per CPU,
+    reduced if needed so that the part buffers in flight stay within an
+    eighth of the host memory. The part size is shared by the units writing
+    to the bucket, so it only comes from configuration. The connection pool
+    allows a connection for each upload thread and read ahead segment.
+
+    :param cpus: number of CPUs, defaults to the host CPU count
+    :type cpus: Optional[int]
+    :param memory_mb: memory in MB, defaults to the host total memory
+    :type memory_mb: Optional[int]
+    :rtype: S3Tuning
+    """
+    snapshot = get_config_snapshot()
+    if cpus is None:
+        cpus = os.cpu_count() or 1
+    if memory_mb is None:
+        memory_mb = ch_host.get_total_ram() // (1024 * 1024)
+
+    part_size_mb = snapshot.s3_part_size or S3_DEFAULT_PART_SIZE_MB
+    read_ahead = snapshot.s3_read_ahead or S3_MAX_READ_AHEAD
+    threads = snapshot.s3_upload_threads
+    if not threads:
+        threads = min(max(cpus * 2, S3_MIN_UPLOAD_THREADS),
+                      S3_MAX_UPLOAD_THREADS)
+        buffers = memory_mb // S3_BUFFER_MEMORY_FRACTION // part_size_mb
+        threads = max(min(threads, buffers - read_ahead), 1)
+    max_pool_connections = (
+        snapshot.s3_max_pool_connections or threads + read_ahead)
+    return S3Tuning(
+        part_size=part_size_mb * 1024 * 1024,
+        upload_threads=threads,
+        read_ahead=read_ahead,
+        max_pool_connections=max_pool_connections,
+        max_retries=snapshot.s3_max_retries)
+
+
+class FileSearchLimits(typing.NamedTuple):
+    """Resource limits of file search"""
+
+    max_processes: int
+    # memory limit of each process in MB, 0 for no limit
+    memory_limit: int
+    ionice_class: str
+
+
+def get_filesearch_limits(cpus=None, memory_mb=None):
+    """Determine the resource limits of file search.
+
+    Unless configured, the number of concurrent search processes is a
+    process for every two CPUs, limited so that the processes stay within a
+    quarter of the host memory, leaving the rest to wlm-workloads.
+
+    :param cpus: number of CPUs, defaults to the host CPU count
+    :type cpus: Optional[int]
+    :param memory_mb: memory in MB, defaults to the host total memory
+    :type memory_mb: Optional[int]
+    :rtype: FileSearchLimits
+    """
+    snapshot = get_config_snapshot()
+    if cpus is None:
+        cpus = os.cpu_count() or 1
+    if memory_mb is None:
+        memory_mb = ch_host.get_total_ram() // (1024 * 1024)
+    processes = snapshot.filesearch_max_processes
+    if not processes:
+        processes = cpus // 2
+        if snapshot.filesearch_memory_limit:
+            processes = min(
+                processes,
+                memory_mb // FILESEARCH_AUTO_MEMORY_FRACTION //
+                snapshot.filesearch_memory_limit)
+        processes = max(processes, 1)
+    return FileSearchLimits(
+        max_processes=processes,
+        memory_limit=snapshot.filesearch_memory_limit,
+        ionice_class=snapshot.filesearch_ionice_class)
+
+
+def filesearch_limit_errors(cpus=None, memory_mb=None):
+    """Check the file search limits fit the host.
+
+    :param cpus: number of CPUs, defaults to the host CPU count
+    :type cpus: Optional[int]
+    :param memory_mb: memory in MB, defaults to the host total memory
+    :type memory_mb: Optional[int]
+    :returns: description of each limit which does not fit
+    :rtype: List[str]
+    """
+    if cpus is None:
+        cpus = os.cpu_count() or 1
+    if memory_mb is None:
+        memory_mb = ch_host.get_total_ram() // (1024 * 1024)
+    limits = get_filesearch_limits(cpus, memory_mb)
+    errors = []
+    if limits.max_processes > cpus:
+        errors.append(
+            "filesearch-max-processes exceeds the {} CPUs".format(cpus))
+    if limits.memory_limit:
+        # processes sized automatically fit the host, at least one
+        explicit = get_config_snapshot().filesearch_max_processes
+        if limits.memory_limit < FILESEARCH_MIN_MEMORY_MB:
+            errors.append(
+                "filesearch-memory-limit is below {} MB".format(
+                    FILESEARCH_MIN_MEMORY_MB))
+        elif explicit and (limits.max_processes * limits.memory_limit >
+                           memory_mb // FILESEARCH_MAX_MEMORY_FRACTION):
+            errors.append(
+                "{} processes of filesearch-memory-limit exceed half of "
+                "the {} MB of memory".format(
+                    limits.max_processes, memory_mb))
+    if limits.ionice_class not in FILESEARCH_IONICE_CLASSES:
+        errors.append("filesearch-ionice-class must be one of {}".format(
+            ", ".join(FILESEARCH_IONICE_CLASSES)))
+    return errors
+
+
+def filesearch_hv_script(limits):
+    """Return the libguestfs hypervisor wrapper applying file search limits.
+
+    Appliance launches, the qemu invocations with a kernel, wait for one
+    of max_processes lock slots, held until the appliance exits, and run
+    in the ionice class; libguestfs queries of qemu are passed through.
+
+    :param limits: file search limits
+    :type limits: FileSearchLimits
+    :rtype: str
+    """
+    machine = platform.machine()
+    qemu = "/usr/bin/qemu-system-{}".format(QEMU_ARCHES.get(machine, machine))
+    return (
+        "#!/bin/sh\n"
+        "# Managed by Juju; runs the libguestfs appliances of wlm-workloads\n"
+        "# within the filesearch-* limits.\n"
+        "case \" $* \" in\n"
+        "*\" -kernel \"*) ;;\n"
+        "*) exec {qemu} \"$@\" ;;\n"
+        "esac\n"
+        "while :; do\n"
+        "    for slot in {slots}; do\n"
+        "        exec 9>{lock_dir}/trilio-wlm-filesearch.$slot.lock\n"
+        "        if flock -n 9; then\n"
+        "            exec ionice -c {ionice} {qemu} \"$@\"\n"
+        "        fi\n"
+        "    done\n"
+        "    sleep 1\n"
+        "done\n").format(
+            qemu=qemu,
+            slots=" ".join(
+                str(i) for i in range(1, limits.max_processes + 1)),
+            lock_dir=FILESEARCH_LOCK_DIR,
+            ionice=FILESEARCH_IONICE.get(
+                limits.ionice_class, FILESEARCH_IONICE["idle"]))
+
+
+def get_s3_cache_stats():
+    """Return the statistics recorded by the S3 cache eviction job.
+
+    :returns: statistics, see files/s3_cache_evict.py, with the hit ratio
+              of the requests since the cache was first scanned, None when
+              unknown; empty until the job has run
+    :rtype: Dict[str, Any]
+    """
+    try:
+        with open(S3_CACHE_STATS) as f:
+            stats = json.load(f)
+    except (FileNotFoundError, ValueError):
+        return {}
+    hits, misses = stats.get("hits", 0), stats.get("misses", 0)
+    # unknown unless the cache is mounted with strictatime
+    if hits is None or misses is None or not hits + misses:
+        stats["hit-ratio"] = None
+    else:
+        stats["hit-ratio"] = round(hits / (hits + misses), 3)
+    return stats
+
+
+def get_free_space_mb(path):
+    """Return the space available for a path, which may not exist yet.
+
+    :param path: directory
+    :type path: str
+    :returns: free space in MB of the filesystem holding path
+    :rtype: int
+    """
+    while not os.path.exists(path):
+        path = os.path.dirname(path)
+    st = os.statvfs(path)
+    return st.f_bavail * st.f_frsize // (1024 * 1024)
+
+
+def guestfs_appliance_inputs():
+    """Return the kernel and libguestfs version an appliance is built for.
+
+    :rtype: Dict[str, Optional[str]]
+    """
+    return {
+        "kernel": os.uname().release,
+        "libguestfs": get_installed_version(GUESTFS_APPLIANCE_PACKAGE),
+    }
+
+
+def get_guestfs_appliance_state():
+    """Describe the prebuilt libguestfs appliance.
+
+    :returns: the recorded build, with the current kernel and libguestfs
+              version, a state of 'missing', 'stale' or 'current' and the
+              error of the last build if it failed
+    :rtype: Dict[str, Any]
+    """
+    kv = unitdata.kv()
+    built = kv.get(GUESTFS_APPLIANCE_KEY) or {}
+    state = dict(built)
+    failed = kv.get(GUESTFS_APPLIANCE_FAILED_KEY)
+    if failed:
+        state["build-error"] = failed["error"]
+        state["build-failed-at"] = failed["failed-at"]
+    inputs = guestfs_appliance_inputs()
+    state["path"] = GUESTFS_APPLIANCE_DIR
+    state["current-kernel"] = inputs["kernel"]
+    state["current-libguestfs"] = inputs["libguestfs"]
+    if not built or not os.path.isdir(GUESTFS_APPLIANCE_DIR):
+        state["state"] = "missing"
+    elif any(built.get(k) != v for k, v in inputs.items()):
+        state["state"] = "stale"
+    else:
+        state["state"] = "current"
+    return state
+
+
+def _grant_restart(lock, unit, granted, queue):
+    """Grant the restart lock to up to rolling-restart-concurrency units.
+
+    See charmhelpers.coordinator.Serial.default_grant for the arguments.
+    """
+    slots = get_config_snapshot().rolling_restart_concurrency - len(granted)
+    return unit in queue[:max(slots, 0)]
+
+
+def restart_coordinator():
+    """Return the coordinator serialising service restarts across units.
+
+    :rtype: charmhelpers.coordinator.Serial
+    """
+    serial = coordinator.Serial(
+        relation_key="trilio-wlm-restarts", peer_relation_name="cluster")
+    serial.grant_restart = _grant_restart
+    return serial
+
+
+# The coordinator must exist before the hook body runs so that its atstart
+# callbacks grant and release locks on the leader in every hook.
+restart_coordinator()
+
+
+def status_inputs_hash():
+    """Return a hash of the state the workload status is assessed from.
+
+    Covers the charm configuration, the leader settings, which hold the
+    trust and license state, the unit pause state and the reactive flags,
+    which reflect the state of the relations. Flags only set while a change
+    is being handled are ignored.
+
+    :rtype: str
+    """
+    flags = sorted(
+        f for f in reactive.get_flags()
+        if ".changed" not in f and f != STATUS_CACHED_FLAG)
+    inputs = {
+        "config": hookenv.config(),
+        "leader": hookenv.leader_get(),
+        "paused": unitdata.kv().get("unit-paused"),
+        "guestfs-failed": unitdata.kv().get(GUESTFS_APPLIANCE_FAILED_KEY),
+        "flags": flags,
+    }
+    return hashlib.sha256(json.dumps(
+        inputs, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def services_active(services):
+    """Probe whether all services are active with a single systemctl call.
+
+    :param services: systemd service names
+    :type services: List[str]
+    :rtype: bool
+    """
+    if not services:
+        return True
+    try:
+        output = subprocess.check_output(
+            ["systemctl", "is-active"] + list(services),
+            universal_newlines=True)
+    except subprocess.CalledProcessError:
+        return False
+    return output.split() == ["active"] * len(services)
+
+
+def cache_status(services):
+    """Record the current workload status for use by update-status.
+
+    :param services: services which must be active for the status to hold
+    :type services: List[str]
+    """
+    unitdata.kv().set(STATUS_CACHE_KEY, {
+        "inputs": status_inputs_hash(),
+        "services": list(services),
+        "status": list(hookenv.status_get()),
+    })
+
+
+def set_cached_status():
+    """Set the workload status from the cache if it is still valid.
+
+    The cached status is valid while the state it was assessed from is
+    unchanged and all services are active. When used, the
+    STATUS_CACHED_FLAG flag is set for the rest of the hook so that
+    handlers which would re-render configuration are skipped.
+
+    :returns: whether the cached status was used
+    :rtype: bool
+    """
+    cached = unitdata.kv().get(STATUS_CACHE_KEY)
+    if not cached or cached["inputs"] != status_inputs_hash():
+        return False
+    if not services_active(cached["services"]):
+        return False
+    hookenv.status_set(*cached["status"])
+    reactive.set_flag(STATUS_CACHED_FLAG)
+    hookenv.atexit(reactive.clear_flag, STATUS_CACHED_FLAG)
+    return True
+
+
+def _get_internal_url(identity_service, service):
+    return get_endpoint_url(identity_service, service, "internal")
+
+
 @charms_openstack.adapters.config_property
 def translated_backup_target_type(cls):
-    _type = hookenv.config("backup-target-type").lower()
-    if _type == "experimental-s3":
-        return 's3'
-    return _type
+    return get_config_snapshot().storage_type
+
+
+@charms_openstack.adapters.config_property
+def api_worker_count(cls):
+    return get_worker_counts().api
+
+
+@charms_openstack.adapters.config_property
+def workloads_worker_count(cls):
+    return get_worker_counts().workloads
+
+
+@charms_openstack.adapters.config_property
+def s3_tuning(cls):
+    return get_s3_tuning()
+
+
+@charms_openstack.adapters.config_property
+def s3_cache_evict_command(cls):
+    """Command run by cron to keep the S3 cache within s3-cache-size"""
+    snapshot = get_config_snapshot()
+    return (
+        "/usr/bin/python3 {} --cache-dir {} --max-size {} "
+        "--state-file {}".format(
+            os.path.join(hookenv.charm_dir(), "files", "s3_cache_evict.py"),
+            snapshot.s3_cache_dir, snapshot.s3_cache_size, S3_CACHE_STATS))
+
+
+@charms_openstack.adapters.config_property
+def filesearch_limits(cls):
+    return get_filesearch_limits()
+
+
+@charms_openstack.adapters.config_property
+def filesearch_memsize(cls):
+    """LIBGUESTFS_MEMSIZE of the appliances, None when not limited or the
+    limit is too small to run them.
+    """
+    memory_limit = get_filesearch_limits().memory_limit
+    if memory_limit < FILESEARCH_MIN_MEMORY_MB:
+        return None
+    return memory_limit
+
+
+@charms_openstack.adapters.config_property
+def filesearch_hv(cls):
+    return FILESEARCH_HV
+
+
+@charms_openstack.adapters.config_property
+def service_resources(cls):
+    return get_config_snapshot().service_resources()
+
+
+@charms_openstack.adapters.config_property
+def guestfs_appliance_path(cls):
+    """LIBGUESTFS_PATH for wlm-workloads, once the appliance is built"""
+    if unitdata.kv().get(GUESTFS_APPLIANCE_KEY):
+        return GUESTFS_APPLIANCE_DIR
+    return None
+
+
+@charms_openstack.adapters.config_property
+def nfs_mount_options(cls):
+    """nfs-options with any profile expanded and without the options which
+    fail validation, see TrilioWLMConfig.nfs_option_errors.
+    """
+    return nfs.valid_options(get_config_snapshot().nfs_options)
+
+
+@charms_openstack.adapters.config_property
+def rpc_executor_thread_pool_size(cls):
+    """RPC executor thread pool size, sized so that every wlm-workloads
+    worker can have RPC calls in flight without starving the others.
+    """
+    size = get_config_snapshot().executor_thread_pool_size
+    if size > 0:
+        return size
+    return max(
+        get_worker_counts().workloads * EXECUTOR_THREADS_PER_WORKER,
+        MIN_EXECUTOR_THREAD_POOL_SIZE)
+
+
+@charms_openstack.adapters.config_property
+def messaging_options(cls):
+    """oslo.messaging settings keyed by option, None for the options with
+    invalid values, which are not rendered so that the defaults apply.
+    """
+    snapshot = get_config_snapshot()
+    invalid = snapshot.invalid_messaging_options()
+    return {
+        option.replace("-", "_"): (
+            None if option in invalid
+            else getattr(snapshot, option.replace("-", "_")))
+        for option in MESSAGING_OPTIONS}
 
 
 @charms_openstack.adapters.adapter_property("identity-service")
@@ -51,7 +1143,7 @@ def neutron_url(identity_service):
 
 @charms_openstack.adapters.adapter_property("identity-service")
 def cinder_url(identity_service):
-    return _get_internal_url(identity_service, "cinderv2")
+    return _get_internal_url(identity_service, "cinder")
 
 
 @charms_openstack.adapters.adapter_property("identity-service")
@@ -70,22 +1162,76 @@ class IdentityServiceIncompleteException(Exception):
     pass
 
 
+class UpgradePrefetchException(Exception):
+    """Raised when packages could not be downloaded ahead of an upgrade"""
+    pass
+
+
 class LicenseFileMissingException(Exception):
     """Signal that the license file has not been provided as a resource"""
 
     pass
 
 
+def get_mysql_router_socket(host):
+    """Return the unix socket of a local mysql-router subordinate.
+
+    mysql-router subordinates provide shared-db with a loopback address
+    and also listen on a unix socket in their working directory, which
+    avoids a TCP connection for every database session.
+
+    :param host: database host provided over shared-db
+    :type host: str
+    :returns: path to the socket or None if not available
+    :rtype: Optional[str]
+    """
+    if not get_config_snapshot().database_use_router_socket:
+        return None
+    if host not in LOCAL_HOSTS:
+        return None
+    for rid in hookenv.relation_ids("shared-db"):
+        for unit in hookenv.related_units(rid):
+            socket = MYSQL_ROUTER_SOCKET.format(unit.split("/")[0])
+            if os.path.exists(socket):
+                return socket
+    return None
+
+
 class TrilioWLMDatabaseAdapter(
         charms_openstack.adapters.DatabaseRelationAdapter):
     """
-    Overrides default class to force use of the mysqldb driver
+    Overrides default class to force use of the mysqldb driver and to
+    connect through the socket of a local mysql-router when available
     """
 
     @property
     def driver(self):
         return "mysql"
 
+    def get_uri(self, prefix=None):
+        uri = super().get_uri(prefix=prefix)
+        socket = get_mysql_router_socket(self.host)
+        if not socket:
+            return uri
+        # libmysqlclient only connects through unix_socket for localhost,
+        # any other host, loopback addresses included, is reached over TCP
+        parts = urllib.parse.urlsplit(uri)
+        userinfo = parts.netloc.rpartition("@")[0]
+        return urllib.parse.urlunsplit(parts._replace(
+            netloc="{}@localhost".format(userinfo) if userinfo
+            else "localhost",
+            query="&".join(
+                q for q in (parts.query, "unix_socket={}".format(socket))
+                if q)))
+
+    @property
+    def pool(self):
+        """Connection pool settings for the [database] section
+
+        :rtype: DatabasePool
+        """
+        return get_database_pool()
+
 
 class TrilioWLMCharmRelationAdapters(
         charms_openstack.adapters.OpenStackAPIRelationAdapters):
@@ -117,6 +1263,7 @@ class TrilioWLMBaseCharm(charms_openstack.plugins.TrilioVaultCharm):
 
     base_packages = [
         "linux-image-virtual",  # Used for libguestfs supermin appliance
+        "libguestfs-tools",  # Provides libguestfs-make-fixed-appliance
         "nova-common",
         "workloadmgr",
         "python3-workloadmgrclient",
@@ -178,20 +1325,25 @@ class TrilioWLMBaseCharm(charms_openstack.plugins.TrilioVaultCharm):
 
     endpoint_template = "{}/v1/$(tenant_id)s"
 
+    # Options in workloadmgr.conf which are only read by some of the
+    # workloadmgr services, keyed by (section, option); an option of None
+    # matches every option in the section. Changes to options not listed
+    # here restart all services.
+    workloadmgr_conf_option_services = {
+        ("DEFAULT", "api_workers"): ["wlm-api"],
+        ("DEFAULT", "workloads_workers"): ["wlm-workloads"],
+        ("DEFAULT", "max_wait_for_upload"): ["wlm-workloads"],
+        ("DEFAULT", "progress_tracking_update_interval"): ["wlm-workloads"],
+        ("global_job_scheduler", "misfire_grace_time"): ["wlm-cron"],
+        ("filesearch", None): ["wlm-workloads"],
+    }
+
     def __init__(self, release=None, **kwargs):
         super().__init__(release="stein", **kwargs)
 
     @property
     def backup_target_type(self):
-        # The main purpose of this property is to translate experimental-s3
-        # to s3. This allows users who tried experimental-s3 a grace period
-        # before being pushed to s3.
-        _type = hookenv.config("backup-target-type").lower()
-        if _type in ('experimental-s3', 's3'):
-            return 's3'
-        if _type == 'nfs':
-            return 'nfs'
-        return 'UNKNOWN'
+        return get_config_snapshot().backup_target_type
 
     # List of packages to install for this charm
     # NOTE(jamespage): nova-common ensures a consistent UID is use
@@ -247,19 +1399,331 @@ class TrilioWLMBaseCharm(charms_openstack.plugins.TrilioVaultCharm):
     @property
     def restart_map(self):
         """Generate the restart map for this service
+
+        Services are restarted for changes to workloadmgr.conf based on the
+        options which changed, see restart_on_change.
         """
         _restart_map = {
-            self.workloadmgr_conf: self.services,
+            self.workloadmgr_conf: [],
             self.api_paste_ini: ["wlm-api"],
             self.alembic_ini: [],
+            GUESTFS_APPLIANCE_DROPIN: ["wlm-workloads"],
         }
         if self.backup_target_type == 's3':
             _restart_map[self.object_store_conf] = ['tvault-object-store']
             _restart_map[
                 charms_openstack.plugins.trilio.S3_SSL_CERT_FILE] = [
                     'tvault-object-store']
+            _restart_map[S3_CACHE_CRON] = []
+        services = self.services
+        for service in systemd.DEFAULT_RESOURCES:
+            if service in services:
+                _restart_map[systemd.dropin(service)] = [service]
         return _restart_map
 
+    def workloadmgr_conf_restarts(self, before, after):
+        """Determine the services to restart for a workloadmgr.conf change.
+
+        :param before: options prior to rendering, None if the file did not
+                       exist
+        :type before: Optional[Dict[Tuple[str, str], str]]
+        :param after: options after rendering
+        :type after: Optional[Dict[Tuple[str, str], str]]
+        :returns: services to restart
+        :rtype: List[str]
+        """
+        if before is None or after is None:
+            return self.services
+        restarts = set()
+        for section, option in changed_config_options(before, after):
+            option_map = self.workloadmgr_conf_option_services
+            restarts.update(option_map.get(
+                (section, option),
+                option_map.get((section, None), self.services)))
+        return [s for s in self.services if s in restarts]
+
+    def restart_services(self, services):
+        """Restart services, coordinating with the other units.
+
+        When rolling restarts are enabled the services are queued until the
+        leader grants this unit the restart lock, see run_pending_restarts.
+        They are also queued while the leader migrates the database schema,
+        see db_sync.
+
+        :param services: services to restart
+        :type services: List[str]
+        """
+        if not services:
+            return
+        if (get_config_snapshot().rolling_restart_concurrency < 1 and
+                not db_sync_waiting()):
+            self._restart_services(services)
+            return
+        kv = unitdata.kv()
+        pending = kv.get(PENDING_RESTARTS_KEY) or []
+        pending.extend(s for s in services if s not in pending)
+        kv.set(PENDING_RESTARTS_KEY, pending)
+        reactive.set_flag(RESTART_PENDING_FLAG)
+        self.run_pending_restarts()
+
+    def run_pending_restarts(self):
+        """Restart queued services once the restart lock is granted.
+
+        The lock is released at the end of the hook, after the API has
+        been confirmed to be answering again.
+        """
+        kv = unitdata.kv()
+        services = kv.get(PENDING_RESTARTS_KEY)
+        if services and db_sync_waiting():
+            hookenv.log(
+                "Waiting for the leader to migrate the database schema to "
+                "restart {}".format(", ".join(services)), level=hookenv.INFO)
+            return
+        coordinated = get_config_snapshot().rolling_restart_concurrency > 0
+        if (services and coordinated and
+                not restart_coordinator().acquire(RESTART_LOCK)):
+            hookenv.log("Waiting for restart lock to restart {}".format(
+                ", ".join(services)), level=hookenv.INFO)
+            return
+        if services:
+            self._restart_services(services)
+            if coordinated and "wlm-api" in services:
+                self.wait_for_api()
+        kv.unset(PENDING_RESTARTS_KEY)
+        reactive.clear_flag(RESTART_PENDING_FLAG)
+
+    def _restart_services(self, services):
+        hookenv.log("Restarting {}".format(", ".join(services)),
+                    level=hookenv.INFO)
+        for service in services:
+            ch_host.service_stop(service)
+        for service in services:
+            ch_host.service_start(service)
+
+    def wait_for_api(self, timeout=API_WAIT_TIMEOUT):
+        """Wait for the local wlm-api service to answer HTTP requests.
+
+        :param timeout: seconds to wait
+        :type timeout: int
+        :returns: True if the API answered within the timeout
+        :rtype: bool
+        """
+        port = ch_cluster.determine_api_port(
+            self.api_port("workloadmgr-api"), singlenode_mode=True)
+        deadline = time.monotonic() + timeout
+        while True:
+            conn = http.client.HTTPConnection("127.0.0.1", port, timeout=5)
+            try:
+                conn.request("GET", "/")
+                conn.getresponse()
+                return True
+            except (OSError, http.client.HTTPException):
+                if time.monotonic() >= deadline:
+                    hookenv.log(
+                        "wlm-api not answering on port {} after {}s".format(
+                            port, timeout), level=hookenv.WARNING)
+                    return False
+                time.sleep(2)
+            finally:
+                conn.close()
+
+    @contextlib.contextmanager
+    def restart_on_change(self):
+        """Restart services for configuration files changed by the wrapped
+        call.
+
+        Changes to files in full_restart_map restart the mapped services,
+        except for workloadmgr.conf where only the services which read the
+        changed options are restarted, so that tuning a single daemon does
+        not interrupt jobs running in the others. Services of a paused unit
+        are not restarted.
+        """
+        restart_map = self.full_restart_map
+        checksums = {path: ch_host.path_hash(path) for path in restart_map}
+        options = read_config_options(self.workloadmgr_conf)
+        yield
+        restarts = []
+        daemon_reload = False
+        for path, services in restart_map.items():
+            if ch_host.path_hash(path) == checksums[path]:
+                continue
+            if path == self.workloadmgr_conf:
+                services = self.workloadmgr_conf_restarts(
+                    options, read_config_options(self.workloadmgr_conf))
+            daemon_reload |= path.startswith(systemd.SYSTEMD_DIR)
+            restarts.extend(services)
+        if daemon_reload:
+            subprocess.check_call(["systemctl", "daemon-reload"])
+        if os_utils.is_unit_paused_set():
+            return
+        self.restart_services(
+            list(collections.OrderedDict.fromkeys(restarts)))
+
+    def db_sync_state(self):
+        """Return the schema state expected by the installed packages.
+
+        :returns: leader settings describing the expected schema state
+        :rtype: Dict[str, Optional[str]]
+        """
+        return {
+            DB_SYNC_VERSION_KEY: get_installed_version(self.version_package),
+            DB_SYNC_REVISION_KEY: get_alembic_head(),
+        }
+
+    def db_sync_done(self):
+        """Determine whether the database schema is at the head revision
+        for the installed workloadmgr package.
+
+        :returns: True if no migration is required
+        :rtype: bool
+        """
+        settings = hookenv.leader_get() or {}
+        if not settings.get("db-sync-done"):
+            return False
+        return all(settings.get(k) == v
+                   for k, v in self.db_sync_state().items())
+
+    def db_sync(self):
+        """Migrate the database schema to the head revision.
+
+        The migration is only run on the leader, and only when the installed
+        workloadmgr package version or alembic head revision differs from
+        the state recorded in leader settings by the last migration, along
+        with how long it took.
+
+        Other units whose packages expect a state the leader has not
+        recorded yet, as during an upgrade, hold their service restarts
+        until the leader settings change to that state.
+        """
+        if self.db_sync_done():
+            if db_sync_waiting():
+                reactive.clear_flag(DB_SYNC_WAIT_FLAG)
+                self.run_pending_restarts()
+            return
+        if not hookenv.is_leader():
+            hookenv.log("Deferring DB sync to leader", level=hookenv.DEBUG)
+            reactive.set_flag(DB_SYNC_WAIT_FLAG)
+            return
+        state = self.db_sync_state()
+        hookenv.log("Migrating database schema to {}".format(
+            state[DB_SYNC_REVISION_KEY]), level=hookenv.INFO)
+        started = time.time()
+        subprocess.check_call(self.sync_cmd)
+        settings = {
+            "db-sync-done": True,
+            DB_SYNC_SECONDS_KEY: round(time.time() - started, 1),
+        }
+        settings.update(state)
+        hookenv.leader_set(settings)
+        reactive.clear_flag(DB_SYNC_WAIT_FLAG)
+        # Restart services after db sync so they pick up the migrated schema,
+        # along with the restarts queued while migrating, holding the restart
+        # lock like any other restart.
+        self.restart_services(self.services)
+
+    def pending_upgrade_downloads(self):
+        """Return the packages an upgrade would still have to download.
+
+        :returns: file names of the packages missing from the apt cache
+        :rtype: List[str]
+        """
+        pending = []
+        for args in (["dist-upgrade"], ["install"] + self.all_packages):
+            output = subprocess.check_output(
+                ["apt-get", "--print-uris", "--quiet", "--quiet", "--yes"] +
+                args, universal_newlines=True)
+            pending.extend(
+                line.split()[1] for line in output.splitlines()
+                if line.startswith("'"))
+        return sorted(set(pending))
+
+    def prefetch_trilio_upgrade(self):
+        """Download the packages of an upgrade into the apt cache.
+
+        The package indexes are refreshed and the packages, with any
+        upgrades of the rest of the system, are downloaded and verified by
+        apt without being installed, so that update-trilio can install them
+        without downloading.
+
+        :returns: the prefetch recorded in unit data
+        :rtype: Dict[str, Any]
+        :raises: UpgradePrefetchException if packages are still missing
+        """
+        hookenv.status_set("maintenance", "Downloading trilio upgrade")
+        started = time.time()
+        self.configure_source()
+        fetch.apt_update(fatal=True)
+        pending = self.pending_upgrade_downloads()
+        options = UPGRADE_DPKG_OPTS + ["--download-only"]
+        fetch.apt_upgrade(fatal=True, dist=True, options=options)
+        fetch.apt_install(self.all_packages, fatal=True, options=options)
+        missing = self.pending_upgrade_downloads()
+        if missing:
+            raise UpgradePrefetchException(
+                "Packages not downloaded: {}".format(", ".join(missing)))
+        prefetch = {
+            "packages": self.all_packages,
+            "downloaded": len(pending),
+            "seconds": round(time.time() - started, 1),
+            "prefetched-at": time.strftime(
+                "%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        }
+        kv = unitdata.kv()
+        kv.set(UPGRADE_PREFETCH_KEY, prefetch)
+        kv.flush()
+        return prefetch
+
+    def trilio_upgrade_prefetched(self):
+        """Determine whether the upgrade can be installed from the apt cache.
+
+        :rtype: bool
+        """
+        prefetch = unitdata.kv().get(UPGRADE_PREFETCH_KEY)
+        return bool(prefetch and
+                    prefetch["packages"] == self.all_packages and
+                    not self.pending_upgrade_downloads())
+
+    def run_trilio_upgrade(self, interfaces_list=None):
+        """Upgrade the Trilio packages, render the configuration and migrate
+        the database schema.
+
+        Packages prefetched by prefetch_trilio_upgrade are installed from
+        the apt cache; otherwise they are downloaded first, before anything
+        is installed, so that the download is never part of the outage.
+        Service restarts for the new configuration are held until the
+        schema has been migrated, see db_sync.
+
+        :param interfaces_list: interfaces to render the configuration with
+        :type interfaces_list: List
+        :returns: whether the packages were prefetched, and the seconds
+                  taken by each phase
+        :rtype: Tuple[bool, collections.OrderedDict]
+        """
+        timings = collections.OrderedDict()
+        started = time.time()
+        prefetched = self.trilio_upgrade_prefetched()
+        if not prefetched:
+            self.prefetch_trilio_upgrade()
+        timings["download"] = round(time.time() - started, 1)
+
+        hookenv.status_set("maintenance", "Installing trilio upgrade")
+        started = time.time()
+        options = UPGRADE_DPKG_OPTS + ["--no-download"]
+        fetch.apt_upgrade(fatal=True, dist=True, options=options)
+        fetch.apt_install(self.all_packages, fatal=True, options=options)
+        timings["install"] = round(time.time() - started, 1)
+
+        started = time.time()
+        reactive.set_flag(DB_SYNC_WAIT_FLAG)
+        self.render_with_interfaces(interfaces_list)
+        timings["configure"] = round(time.time() - started, 1)
+
+        started = time.time()
+        self.db_sync()
+        timings["migrate"] = round(time.time() - started, 1)
+        unitdata.kv().unset(UPGRADE_PREFETCH_KEY)
+        return prefetched, timings
+
     def configure_ha_resources(self, hacluster):
         """Inform the ha subordinate about each service it should manage.
 
@@ -271,46 +1735,85 @@ class TrilioWLMBaseCharm(charms_openstack.plugins.TrilioVaultCharm):
         super().configure_ha_resources(hacluster)
         hacluster.add_systemd_service(self.name, "wlm-cron", clone=False)
 
-    def create_trust(self, identity_service, cloud_admin_password):
-        """Create trust between Trilio WLM service user and Cloud Admin
+    @staticmethod
+    def _keystone_auth_url(identity_service):
+        return "{}://{}:{}/v3".format(
+            identity_service.service_protocol(),
+            identity_service.service_host(),
+            identity_service.service_port(),
+        )
+
+    def _workloadmgr_client(self, credentials):
+        """Return an in-process workloadmgr API client.
+
+        :param credentials: keystone credentials to authenticate with
+        :type credentials: Dict[str, str]
+        :returns: client for the project scoped workloadmgr endpoint
+        :rtype: workloadmgr_client.WorkloadMgrClient
+        """
+        session = workloadmgr_client.get_session(**credentials)
+        endpoint = self.internal_url.replace(
+            "$(tenant_id)s", credentials["project_id"])
+        return workloadmgr_client.WorkloadMgrClient(session, endpoint)
+
+    def _workloadmgr_cli(self, credentials, *args):
+        """Run the workloadmgr CLI with the provided credentials.
+
+        Used when the in-process client is not available.
         """
-        if not hookenv.is_leader():
-            raise charms_openstack.plugins.classes.UnitNotLeaderException(
-                "please run on leader unit")
-        if not identity_service.base_data_complete():
-            raise IdentityServiceIncompleteException(
-                "identity-service relation incomplete"
-            )
-        # NOTE(jamespage): hardcode of admin username here may be brittle
         subprocess.check_call(
             [
                 "workloadmgr",
                 "--os-username",
-                "admin",
+                credentials["username"],
                 "--os-password",
-                cloud_admin_password,
+                credentials["password"],
                 "--os-auth-url",
-                "{}://{}:{}/v3".format(
-                    identity_service.service_protocol(),
-                    identity_service.service_host(),
-                    identity_service.service_port(),
-                ),
+                credentials["auth_url"],
                 "--os-user-domain-name",
-                "admin_domain",
+                credentials["user_domain_name"],
                 "--os-project-domain-id",
-                identity_service.admin_domain_id(),
+                credentials["project_domain_id"],
                 "--os-project-id",
-                identity_service.admin_project_id(),
+                credentials["project_id"],
                 "--os-project-name",
-                "admin",
+                credentials["project_name"],
                 "--os-region-name",
                 hookenv.config("region"),
+            ] + list(args)
+        )
+
+    def create_trust(self, identity_service, cloud_admin_password):
+        """Create trust between Trilio WLM service user and Cloud Admin
+        """
+        if not hookenv.is_leader():
+            raise charms_openstack.plugins.classes.UnitNotLeaderException(
+                "please run on leader unit")
+        if not identity_service.base_data_complete():
+            raise IdentityServiceIncompleteException(
+                "identity-service relation incomplete"
+            )
+        # NOTE(jamespage): hardcode of admin username here may be brittle
+        credentials = {
+            "auth_url": self._keystone_auth_url(identity_service),
+            "username": "admin",
+            "password": cloud_admin_password,
+            "user_domain_name": "admin_domain",
+            "project_domain_id": identity_service.admin_domain_id(),
+            "project_id": identity_service.admin_project_id(),
+            "project_name": "admin",
+        }
+        if workloadmgr_client.available():
+            self._workloadmgr_client(credentials).create_trust(
+                "Admin", is_cloud_trust=True)
+        else:
+            self._workloadmgr_cli(
+                credentials,
                 "trust-create",
                 "--is_cloud_trust",
                 "True",
                 "Admin",
-            ]
-        )
+            )
         hookenv.leader_set({"trusted": True})
 
     def create_license(self, identity_service):
@@ -326,33 +1829,26 @@ class TrilioWLMBaseCharm(charms_openstack.plugins.TrilioVaultCharm):
             raise IdentityServiceIncompleteException(
                 "identity-service relation incomplete"
             )
-        subprocess.check_call(
-            [
-                "workloadmgr",
-                "--os-username",
-                identity_service.service_username(),
-                "--os-password",
-                identity_service.service_password(),
-                "--os-auth-url",
-                "{}://{}:{}/v3".format(
-                    identity_service.service_protocol(),
-                    identity_service.service_host(),
-                    identity_service.service_port(),
-                ),
-                "--os-user-domain-name",
-                "service_domain",
-                "--os-project-domain-id",
-                identity_service.service_domain_id(),
-                "--os-project-id",
-                identity_service.service_tenant_id(),
-                "--os-project-name",
-                identity_service.service_tenant(),
-                "--os-region-name",
-                hookenv.config("region"),
+        credentials = {
+            "auth_url": self._keystone_auth_url(identity_service),
+            "username": identity_service.service_username(),
+            "password": identity_service.service_password(),
+            "user_domain_name": "service_domain",
+            "project_domain_id": identity_service.service_domain_id(),
+            "project_id": identity_service.service_tenant_id(),
+            "project_name": identity_service.service_tenant(),
+        }
+        if workloadmgr_client.available():
+            with open(license_file) as f:
+                license_text = f.read()
+            self._workloadmgr_client(credentials).create_license(
+                license_text)
+        else:
+            self._workloadmgr_cli(
+                credentials,
                 "license-create",
                 license_file,
-            ]
-        )
+            )
         hookenv.leader_set({"licensed": True})
 
     @property
@@ -363,27 +1859,404 @@ class TrilioWLMBaseCharm(charms_openstack.plugins.TrilioVaultCharm):
     def trusted(self):
         return hookenv.leader_get("trusted")
 
+    def nfs_share_mountpoint(self, share):
+        """Return the path workloadmgr mounts an NFS share on.
+
+        The directory name is encoded differently by each Trilio release,
+        see _encode_endpoint.
+
+        :param share: NFS share, host:/path
+        :type share: str
+        :rtype: str
+        """
+        return os.path.join(nfs.TV_MOUNTS, self._encode_endpoint(share))
+
+    def mount_nfs_shares(self):
+        """Mount the NFS shares which have their own mount options.
+
+        workloadmgr mounts every share with nfs-options unless the share is
+        already mounted; shares with their own options in nfs-share-options
+        are mounted by the charm beforehand, and unmounted again when their
+        options change so they are mounted with the new options.
+        """
+        snapshot = get_config_snapshot()
+        wanted = {}
+        if snapshot.backup_target_type == "nfs":
+            wanted = snapshot.nfs_share_mount_options()
+        kv = unitdata.kv()
+        mounted = kv.get(NFS_MOUNTS_KEY) or {}
+        for share, options in sorted(mounted.items()):
+            if wanted.get(share) == options:
+                continue
+            if not ch_host.umount(self.nfs_share_mountpoint(share),
+                                  persist=True):
+                hookenv.log(
+                    "Unable to unmount {} to apply new mount options; "
+                    "it is in use".format(share), level=hookenv.WARNING)
+                continue
+            del mounted[share]
+        for share, options in sorted(wanted.items()):
+            if share in mounted:
+                continue
+            mountpoint = self.nfs_share_mountpoint(share)
+            if os.path.ismount(mountpoint):
+                # mounted by workloadmgr with nfs-options
+                if not ch_host.umount(mountpoint):
+                    hookenv.log(
+                        "Unable to unmount {} to apply its mount options; "
+                        "it is in use".format(share), level=hookenv.WARNING)
+                    continue
+            ch_host.mkdir(mountpoint)
+            if ch_host.mount(share, mountpoint, options=options,
+                             persist=True, filesystem="nfs"):
+                mounted[share] = options
+        kv.set(NFS_MOUNTS_KEY, mounted)
+
+    def configure_filesearch_limits(self):
+        """Install the hypervisor wrapper of the libguestfs appliances,
+        which applies the file search limits, see filesearch_hv_script.
+        """
+        content = filesearch_hv_script(get_filesearch_limits())
+        try:
+            with open(FILESEARCH_HV) as f:
+                if f.read() == content:
+                    return
+        except FileNotFoundError:
+            pass
+        ch_host.mkdir(os.path.dirname(FILESEARCH_HV))
+        ch_host.write_file(FILESEARCH_HV, content.encode(), perms=0o755)
+
+    def configure_s3_cache(self):
+        """Create the S3 FUSE plugin cache directory when it is managed.
+
+        The directory is bind mounted onto itself with strictatime, unless
+        it is already a mount point, so that reads update the access times
+        which eviction and the hit ratio rely on; relatime, the default,
+        updates them at most daily.
+        """
+        snapshot = get_config_snapshot()
+        if snapshot.backup_target_type == "s3" and snapshot.s3_cache_size:
+            ch_host.mkdir(snapshot.s3_cache_dir, perms=0o700)
+            ch_host.mkdir(os.path.dirname(S3_CACHE_STATS))
+            if not os.path.ismount(snapshot.s3_cache_dir):
+                ch_host.mount(snapshot.s3_cache_dir, snapshot.s3_cache_dir,
+                              options="bind,strictatime", persist=True,
+                              filesystem="none")
+
+    def install(self):
+        """Install the packages and prebuild the libguestfs appliance"""
+        super().install()
+        self.build_guestfs_appliance()
+
+    def build_guestfs_appliance(self):
+        """Build the fixed libguestfs appliance if it is missing or was built
+        for another kernel or libguestfs version.
+
+        The package database is only queried when it changed since the last
+        check. The new appliance is built beside the current one, which
+        stays in use until the build succeeds. A failed build, as on hosts
+        where supermin cannot build appliances, is recorded and not retried
+        until the kernel or the installed packages change.
+
+        :returns: whether the appliance was built
+        :rtype: bool
+        """
+        kv = unitdata.kv()
+        built = kv.get(GUESTFS_APPLIANCE_KEY) or {}
+        failed = kv.get(GUESTFS_APPLIANCE_FAILED_KEY) or {}
+        try:
+            dpkg_mtime = os.stat(DPKG_STATUS).st_mtime
+        except OSError:
+            dpkg_mtime = None
+        kernel = os.uname().release
+        if (built.get("kernel") == kernel and
+                built.get("dpkg-mtime") == dpkg_mtime and
+                os.path.isdir(GUESTFS_APPLIANCE_DIR)):
+            return False
+        if (failed.get("kernel") == kernel and
+                failed.get("dpkg-mtime") == dpkg_mtime):
+            return False
+        inputs = guestfs_appliance_inputs()
+        if (all(built.get(k) == v for k, v in inputs.items()) and
+                os.path.isdir(GUESTFS_APPLIANCE_DIR)):
+            built["dpkg-mtime"] = dpkg_mtime
+            kv.set(GUESTFS_APPLIANCE_KEY, built)
+            return False
+        if failed and all(failed.get(k) == v for k, v in inputs.items()):
+            failed["dpkg-mtime"] = dpkg_mtime
+            kv.set(GUESTFS_APPLIANCE_FAILED_KEY, failed)
+            return False
+        hookenv.status_set("maintenance", "Building libguestfs appliance")
+        build_dir = "{}.new".format(GUESTFS_APPLIANCE_DIR)
+        shutil.rmtree(build_dir, ignore_errors=True)
+        started = time.time()
+        try:
+            subprocess.check_call(
+                ["libguestfs-make-fixed-appliance", build_dir],
+                timeout=GUESTFS_APPLIANCE_BUILD_TIMEOUT)
+        except (subprocess.CalledProcessError, subprocess.TimeoutExpired,
+                OSError) as e:
+            hookenv.log("Unable to build libguestfs appliance: {}".format(e),
+                        level=hookenv.WARNING)
+            shutil.rmtree(build_dir, ignore_errors=True)
+            inputs.update({
+                "dpkg-mtime": dpkg_mtime,
+                "error": str(e),
+                "failed-at": time.strftime(
+                    "%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            })
+            kv.set(GUESTFS_APPLIANCE_FAILED_KEY, inputs)
+            return False
+        old_dir = "{}.old".format(GUESTFS_APPLIANCE_DIR)
+        if os.path.isdir(GUESTFS_APPLIANCE_DIR):
+            os.rename(GUESTFS_APPLIANCE_DIR, old_dir)
+        os.rename(build_dir, GUESTFS_APPLIANCE_DIR)
+        shutil.rmtree(old_dir, ignore_errors=True)
+        inputs.update({
+            "dpkg-mtime": dpkg_mtime,
+            "built-at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            "build-time": round(time.time() - started, 1),
+        })
+        kv.set(GUESTFS_APPLIANCE_KEY, inputs)
+        kv.unset(GUESTFS_APPLIANCE_FAILED_KEY)
+        return True
+
+    def configure_nfs_client_tuning(self):
+        """Apply and persist the host NFS client tuning on nfs targets, or
+        remove it when nfs-client-tuning is unset.
+
+        Kernel parameters are persisted in sysctl.d and modprobe.d, for the
+        sunrpc module, and the read ahead of NFS mounts by a udev rule; the
+        read ahead of the shares already mounted is set directly. Removing
+        the tuning leaves the applied values in place until the next boot.
+        """
+        snapshot = get_config_snapshot()
+        files = collections.OrderedDict([
+            (nfs.SYSCTL_CONF, nfs.sysctl_conf()),
+            (nfs.MODPROBE_CONF, nfs.modprobe_conf()),
+            (nfs.UDEV_RULES, nfs.udev_rules()),
+        ])
+        if not (snapshot.backup_target_type == "nfs" and
+                snapshot.nfs_client_tuning):
+            for path in files:
+                if os.path.exists(path):
+                    os.remove(path)
+            return
+        for path, content in files.items():
+            try:
+                with open(path) as f:
+                    if f.read() == content:
+                        continue
+            except FileNotFoundError:
+                pass
+            ch_host.write_file(path, content.encode())
+            if path == nfs.SYSCTL_CONF:
+                # sunrpc parameters only exist once the module is loaded
+                subprocess.call(["sysctl", "-e", "-p", path])
+            elif path == nfs.UDEV_RULES:
+                subprocess.call(["udevadm", "control", "--reload-rules"])
+        for share in snapshot.nfs_share_list():
+            mountpoint = self.nfs_share_mountpoint(share)
+            if not os.path.ismount(mountpoint):
+                continue
+            try:
+                with open(nfs.read_ahead_path(mountpoint), "w") as f:
+                    f.write(str(nfs.CLIENT_READ_AHEAD_KB))
+            except OSError as e:
+                hookenv.log("Unable to set the read ahead of {}: {}".format(
+                    share, e), level=hookenv.WARNING)
+
+    def backup_target_mounts(self):
+        """Return the mounted backup targets.
+
+        :returns: mount point keyed by NFS share, or by 's3' for the S3 FUSE
+                  mount
+        :rtype: collections.OrderedDict
+        """
+        snapshot = get_config_snapshot()
+        mounts = collections.OrderedDict()
+        if snapshot.backup_target_type == "s3":
+            # tvault-object-store mounts the bucket on vault_data_directory
+            if os.path.ismount(nfs.TV_MOUNTS):
+                mounts["s3"] = nfs.TV_MOUNTS
+        elif snapshot.backup_target_type == "nfs":
+            for share in snapshot.nfs_share_list():
+                mountpoint = self.nfs_share_mountpoint(share)
+                if os.path.ismount(mountpoint):
+                    mounts[share] = mountpoint
+        return mounts
+
+    def nfs_client_tuning_state(self):
+        """Describe the host NFS client tuning in effect.
+
+        :returns: whether the tuning is enabled, the current value of each
+                  tuned kernel parameter and the read ahead of each mounted
+                  share
+        :rtype: Dict[str, Any]
+        """
+        snapshot = get_config_snapshot()
+        read_ahead = collections.OrderedDict()
+        for share in snapshot.nfs_share_list():
+            mountpoint = self.nfs_share_mountpoint(share)
+            if not os.path.ismount(mountpoint):
+                continue
+            try:
+                with open(nfs.read_ahead_path(mountpoint)) as f:
+                    read_ahead[share] = int(f.read())
+            except (OSError, ValueError):
+                read_ahead[share] = None
+        return {
+            "enabled": (snapshot.backup_target_type == "nfs" and
+                        snapshot.nfs_client_tuning),
+            "sysctl": collections.OrderedDict(
+                (key, nfs.read_sysctl(key)) for key in nfs.CLIENT_SYSCTL),
+            "read-ahead-kb": read_ahead,
+        }
+
+    def _ghost_nfs_share(self, share_path, ghost_path):
+        """Check a share is responding and bind mount it on a ghost path.
+
+        :raises: OSError if the share does not respond or the mount fails
+        """
+        # blocks while the filer is unreachable
+        os.statvfs(share_path)
+        if not os.path.isdir(ghost_path):
+            os.mkdir(ghost_path)
+        if not ch_host.mount(share_path, ghost_path, options="bind",
+                             filesystem="none"):
+            raise OSError("unable to bind mount {}".format(ghost_path))
+
+    def ghost_nfs_shares(self, ghost_shares, timeout=GHOST_SHARE_TIMEOUT):
+        """Bind mount the local NFS shares on the mount points of the shares
+        of a secondary deployment.
+
+        Shares are checked and mounted concurrently so that an unreachable
+        filer only delays its own share, up to timeout. Shares already bound
+        to the matching local share are skipped, so the action can be run
+        again after a failure.
+
+        :param ghost_shares: comma separated shares of the secondary
+                             deployment, in the order of nfs-shares
+        :type ghost_shares: str
+        :param timeout: seconds allowed for each share
+        :type timeout: float
+        :returns: status ('mounted', 'skipped', 'failed' or 'timeout'),
+                  seconds taken and any error message, keyed by ghost share
+        :rtype: collections.OrderedDict
+        :raises: ValueError if the shares do not match nfs-shares
+        """
+        shares = get_config_snapshot().nfs_share_list()
+        ghosts = [g.strip() for g in ghost_shares.split(",") if g.strip()]
+        if len(ghosts) != len(shares):
+            raise ValueError(
+                "{} shares given for the {} shares in nfs-shares".format(
+                    len(ghosts), len(shares)))
+        # read from /proc/mounts, which does not block on unreachable filers
+        mounts = dict(ch_host.mounts())
+        results = collections.OrderedDict()
+        threads = {}
+        started = time.time()
+
+        def ghost(share_path, ghost_path, result):
+            try:
+                self._ghost_nfs_share(share_path, ghost_path)
+                result["status"] = "mounted"
+            except OSError as e:
+                result.update(status="failed", message=str(e))
+            result["seconds"] = round(time.time() - started, 2)
+
+        for share, ghost_share in zip(shares, ghosts):
+            share_path = self.nfs_share_mountpoint(share)
+            ghost_path = self.nfs_share_mountpoint(ghost_share)
+            result = results[ghost_share] = {"share": share}
+            if share_path not in mounts:
+                result.update(status="failed", seconds=0.0,
+                              message="{} not mounted".format(share))
+            elif ghost_path in mounts:
+                if mounts[ghost_path] == mounts[share_path]:
+                    result.update(status="skipped", seconds=0.0)
+                else:
+                    result.update(
+                        status="failed", seconds=0.0,
+                        message="{} already mounted from {}".format(
+                            ghost_path, mounts[ghost_path]))
+            else:
+                threads[ghost_share] = threading.Thread(
+                    target=ghost, args=(share_path, ghost_path, result),
+                    daemon=True)
+                threads[ghost_share].start()
+        for ghost_share, thread in threads.items():
+            thread.join(max(started + timeout - time.time(), 0))
+            result = results[ghost_share]
+            if thread.is_alive():
+                result.update(status="timeout", seconds=timeout,
+                              message="no response within {}s".format(
+                                  timeout))
+        # persisted from this thread only, and also for skipped shares in
+        # case they were mounted after timing out in a previous run
+        for ghost_share, result in results.items():
+            if result["status"] in ("mounted", "skipped"):
+                ch_host.fstab_add(
+                    self.nfs_share_mountpoint(result["share"]),
+                    self.nfs_share_mountpoint(ghost_share), "none",
+                    options="bind")
+        return results
+
+    def _assess_status(self):
+        """Assess the workload status and cache it for update-status"""
+        super()._assess_status()
+        cache_status(self.services)
+
     def custom_assess_status_check(self):
         """Check required configuration options are set"""
+        snapshot = get_config_snapshot()
         check_config_set = []
-        if self.backup_target_type == "nfs":
+        if snapshot.backup_target_type == "nfs":
             check_config_set = ['nfs-shares']
-        elif self.backup_target_type == "s3":
+        elif snapshot.backup_target_type == "s3":
             check_config_set = [
                 "tv-s3-secret-key",
                 "tv-s3-access-key",
                 "tv-s3-region-name",
                 "tv-s3-bucket",
                 "tv-s3-endpoint-url"]
-        unset_config = [c for c in check_config_set if not hookenv.config(c)]
+        unset_config = snapshot.unset_options(check_config_set)
         if unset_config:
             return "blocked", "{} configuration not set".format(
                 ', '.join(unset_config))
         # For s3 support backup-target-type should be set to 'experimental-s3'
-        # as s3 support is pre-production. The self.backup_target_type
-        # property will do any transaltion needed.
-        if self.backup_target_type not in ["nfs", "s3"]:
+        # as s3 support is pre-production. The config snapshot will do any
+        # translation needed.
+        if snapshot.backup_target_type not in ["nfs", "s3"]:
             return "blocked", "Backup target type not supported"
+        invalid_config = snapshot.invalid_messaging_options()
+        if invalid_config:
+            return "blocked", "{} configuration not valid".format(
+                ', '.join(invalid_config))
+        if snapshot.backup_target_type == "nfs":
+            nfs_errors = snapshot.nfs_option_errors()
+            if nfs_errors:
+                return "blocked", "Invalid NFS mount options: {}".format(
+                    "; ".join(nfs_errors))
+        resource_errors = snapshot.service_resource_errors()
+        if resource_errors:
+            return "blocked", "Invalid service-resource-overrides: {}".format(
+                "; ".join(resource_errors))
+        filesearch_errors = filesearch_limit_errors()
+        if filesearch_errors:
+            return "blocked", "Invalid file search limits: {}".format(
+                "; ".join(filesearch_errors))
+        if snapshot.backup_target_type == "s3" and snapshot.s3_cache_size:
+            # space already used by the cache is available to it
+            available = (get_free_space_mb(snapshot.s3_cache_dir) +
+                         get_s3_cache_stats().get("size", 0) // (1024 * 1024))
+            if available < snapshot.s3_cache_size:
+                return "blocked", (
+                    "Insufficient space for s3-cache-size in {} "
+                    "({} MB available)".format(
+                        snapshot.s3_cache_dir, available))
+        if db_sync_waiting():
+            return "waiting", "Waiting for leader to migrate database schema"
         return None, None
 
     def custom_assess_status_last_check(self):
@@ -399,7 +2272,33 @@ class TrilioWLMBaseCharm(charms_openstack.plugins.TrilioVaultCharm):
                 "blocked",
                 "application not licensed; please run 'create-license' action",
             )
-        return None, None
+        # All checks passed; report the worker counts in use with the
+        # ready message.
+        workers = get_worker_counts()
+        details = "api workers: {}, workloads workers: {}".format(
+            workers.api, workers.workloads)
+        inactive = self.inactive_memory_throttling()
+        if inactive:
+            details += "; MemoryHigh inactive on cgroup v1 for {}".format(
+                ", ".join(inactive))
+        if unitdata.kv().get(GUESTFS_APPLIANCE_FAILED_KEY):
+            details += ("; libguestfs appliance build failed, see "
+                        "guestfs-appliance-status")
+        return "active", "Unit is ready ({})".format(details)
+
+    def inactive_memory_throttling(self):
+        """Return the services whose MemoryHigh has no effect as memory is
+        controlled through cgroup v1 on this host.
+
+        :rtype: List[str]
+        """
+        if systemd.memory_controller_unified():
+            return []
+        services = self.services
+        return [
+            service for service in systemd.throttled_services(
+                get_config_snapshot().service_resources())
+            if service in services]
 
     @classmethod
     def trilio_version_package(cls):
@@ -427,6 +2326,7 @@ class TrilioWLMCharmUssuri41Base(TrilioWLMBaseCharm):
 
     base_packages = [
         "linux-image-virtual",  # Used for libguestfs supermin appliance
+        "libguestfs-tools",  # Provides libguestfs-make-fixed-appliance
         "nova-common",
         "workloadmgr",
         "python3-workloadmgrclient",
@@ -454,3 +2354,51 @@ class TrilioWLMCharmUssuri42(
     # First release supported
     release = "ussuri"
     trilio_release = "4.2"
+
+
+def _charm_class_cache_key():
+    """Return the state the charm class resolution depends on.
+
+    :rtype: List
+    """
+    try:
+        mtime = os.stat(DPKG_STATUS).st_mtime
+    except OSError:
+        mtime = None
+    return [
+        mtime,
+        hookenv.config("openstack-origin"),
+        hookenv.config("triliovault-pkg-source"),
+    ]
+
+
+@contextlib.contextmanager
+def provide_action_charm_instance():
+    """Provide the charm instance for an action.
+
+    Resolving the charm class for the installed OpenStack and TrilioVault
+    releases queries the package database, which dominates the startup time
+    of an action. The resolved class is cached in unit data until the
+    installed packages or the package sources change. Cached classes are
+    instantiated as get_charm_instance does, so the instance has the same
+    release either way.
+
+    :returns: the charm instance
+    :rtype: TrilioWLMBaseCharm
+    """
+    kv = unitdata.kv()
+    key = _charm_class_cache_key()
+    cached = kv.get(CHARM_CLASS_KEY)
+    classes = {
+        cls.__name__: cls for cls in globals().values()
+        if isinstance(cls, type) and issubclass(cls, TrilioWLMBaseCharm)}
+    if cached and cached["key"] == key and cached["class"] in classes:
+        instance = classes[cached["class"]]()
+    else:
+        instance = charms_openstack.charm.get_charm_instance()
+        kv.set(CHARM_CLASS_KEY, {
+            "key": key,
+            "class": type(instance).__name__,
+        })
+        kv.flush()
+    yield instance
@@ -0,0 +1,163 @@
+# Copyright 2020 Canonical Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import time
+
+import charmhelpers.core.hookenv as hookenv
+
+try:
+    from keystoneauth1 import exceptions as ks_exceptions
+    from keystoneauth1 import session as ks_session
+    from keystoneauth1.identity import v3 as ks_v3
+except ImportError:
+    ks_exceptions = ks_session = ks_v3 = None
+
+SYSTEM_CA_BUNDLE = "/etc/ssl/certs/ca-certificates.crt"
+
+DEFAULT_RETRIES = 3
+DEFAULT_BACKOFF = 1.0
+MAX_BACKOFF = 10.0
+
+# Status codes which indicate the request was not processed by the API
+# and can safely be retried.
+RETRY_STATUS_CODES = (429, 503)
+# Gateway errors do not tell whether the API processed the request, so they
+# are only retried for idempotent methods.
+IDEMPOTENT_RETRY_STATUS_CODES = RETRY_STATUS_CODES + (502, 504)
+IDEMPOTENT_METHODS = ("GET", "HEAD", "PUT", "DELETE")
+
+_sessions = {}
+
+
+class WorkloadMgrAPIError(Exception):
+    """Signal that the workloadmgr API rejected a request"""
+
+    def __init__(self, status_code, message):
+        super().__init__(
+            "workloadmgr API error {}: {}".format(status_code, message))
+        self.status_code = status_code
+
+
+def available():
+    """Determine whether the in-process client can be used.
+
+    :returns: True if keystoneauth1 is importable
+    :rtype: bool
+    """
+    return ks_session is not None
+
+
+def get_session(auth_url, username, password, user_domain_name,
+                project_domain_id, project_id, project_name):
+    """Return a keystoneauth session for the provided credentials.
+
+    Sessions are cached for the lifetime of the process so that a single
+    authentication and HTTP connection pool is used per action run.
+
+    :returns: authenticated session
+    :rtype: keystoneauth1.session.Session
+    """
+    key = (auth_url, username, user_domain_name, project_id)
+    if key not in _sessions:
+        auth = ks_v3.Password(
+            auth_url=auth_url,
+            username=username,
+            password=password,
+            user_domain_name=user_domain_name,
+            project_domain_id=project_domain_id,
+            project_id=project_id,
+            project_name=project_name)
+        verify = True
+        if os.path.exists(SYSTEM_CA_BUNDLE):
+            verify = SYSTEM_CA_BUNDLE
+        _sessions[key] = ks_session.Session(auth=auth, verify=verify)
+    return _sessions[key]
+
+
+class WorkloadMgrClient(object):
+    """Minimal client for the workloadmgr API
+
+    Only implements the calls required by the charm actions; requests
+    which fail to connect or are rejected with a transient status code are
+    retried with exponential backoff, bounded by max_backoff. Gateway
+    errors are not retried for POST, such as trust creation, which the API
+    may have processed.
+    """
+
+    def __init__(self, session, endpoint, retries=DEFAULT_RETRIES,
+                 backoff=DEFAULT_BACKOFF, max_backoff=MAX_BACKOFF):
+        self.session = session
+        self.endpoint = endpoint.rstrip("/")
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+
+    def _request(self, method, path, **kwargs):
+        url = "{}{}".format(self.endpoint, path)
+        retry_status_codes = (
+            IDEMPOTENT_RETRY_STATUS_CODES if method in IDEMPOTENT_METHODS
+            else RETRY_STATUS_CODES)
+        attempt = 0
+        while True:
+            try:
+                resp = self.session.request(
+                    url, method, raise_exc=False, **kwargs)
+            except ks_exceptions.ConnectFailure as e:
+                error = e
+            else:
+                if resp.status_code not in retry_status_codes:
+                    break
+                error = WorkloadMgrAPIError(resp.status_code, resp.text)
+            if attempt >= self.retries:
+                raise error
+            delay = min(self.backoff * 2 ** attempt, self.max_backoff)
+            hookenv.log("{} {} failed ({}), retrying in {}s".format(
+                method, url, error, delay), level=hookenv.WARNING)
+            time.sleep(delay)
+            attempt += 1
+        if resp.status_code >= 400:
+            raise WorkloadMgrAPIError(resp.status_code, resp.text)
+        if resp.content:
+            return resp.json()
+        return None
+
+    def create_trust(self, role_name, is_cloud_trust=False):
+        """Create a trust from the authenticated user to the service.
+
+        :param role_name: role to delegate
+        :type role_name: str
+        :param is_cloud_trust: whether this is the cloud admin trust
+        :type is_cloud_trust: bool
+        :returns: API response
+        :rtype: dict
+        """
+        return self._request("POST", "/trusts", json={
+            "trusts": {
+                "role_name": role_name,
+                "is_cloud_trust": is_cloud_trust,
+            }
+        })
+
+    def create_license(self, license_text):
+        """Install a TrilioVault license.
+
+        :param license_text: contents of the license file
+        :type license_text: str
+        :returns: API response
+        :rtype: dict
+        """
+        return self._request("POST", "/workloads/license", json={
+            "license": {"lic_txt": license_text}
+        })
@@ -17,6 +17,10 @@ import charms.reactive as reactive
 
 # This charm's library contains all of the handler code for this charm
 import charm.openstack.trilio_wlm as trilio_wlm  # noqa
+import charm.openstack.profiling as profiling
+
+# Handlers are timed from here on when profiling is enabled
+profiling.enable()
 
 charm.use_defaults(
     "charm.installed",
@@ -24,33 +28,79 @@ charm.use_defaults(
     "shared-db.connected",
     "identity-service.available",  # enables SSL support
     "config.changed",
-    "update-status",
     "certificates.available",
     "cluster.available",
 )
 
 
+@reactive.hook("config-changed")
+def invalidate_config_snapshot():
+    """Discard any configuration snapshot taken before config-changed
+    handlers run.
+    """
+    trilio_wlm.invalidate_config_snapshot()
+
+
+@reactive.hook("leader-settings-changed")
+def leader_settings_changed():
+    """Release the service restarts held for the leader's database
+    migration once it has recorded the schema state this unit expects.
+    """
+    with charm.provide_charm_instance() as charm_class:
+        charm_class.db_sync()
+
+
+@reactive.hook("update-status")
+def update_status():
+    """Refresh the workload version, then reuse the last assessed status
+    while nothing it depends on has changed, otherwise assess the status
+    of the unit.
+    """
+    with charm.provide_charm_instance() as charm_class:
+        charm_class.application_version_set()
+        if trilio_wlm.set_cached_status():
+            return
+        charm_class.assess_status()
+
+
 @reactive.when("shared-db.available")
 @reactive.when("identity-service.available")
 @reactive.when("amqp.available")
+@reactive.when_not(trilio_wlm.STATUS_CACHED_FLAG)
 def render_config(*args):
     """Render the configuration for charm when all the interfaces are
     available.
     """
     with charm.provide_charm_instance() as charm_class:
         charm_class.upgrade_if_available(args)
+        charm_class.build_guestfs_appliance()
+        charm_class.configure_filesearch_limits()
+        charm_class.mount_nfs_shares()
+        charm_class.configure_nfs_client_tuning()
+        charm_class.configure_s3_cache()
         charm_class.render_with_interfaces(args)
         charm_class.assess_status()
     reactive.set_state("config.rendered")
 
 
 @reactive.when("config.rendered")
+@reactive.when_not(trilio_wlm.STATUS_CACHED_FLAG)
 def init_db():
     with charm.provide_charm_instance() as charm_class:
         charm_class.db_sync()
 
 
+@reactive.when("restart.pending")
+def run_pending_restarts():
+    """Restart services queued for a rolling restart once this unit holds
+    the restart lock.
+    """
+    with charm.provide_charm_instance() as charm_class:
+        charm_class.run_pending_restarts()
+
+
 @reactive.when("ha.connected")
+@reactive.when_not(trilio_wlm.STATUS_CACHED_FLAG)
 def cluster_connected(hacluster):
     """Configure HA resources in corosync"""
     with charm.provide_charm_instance() as charm_class:
@@ -59,6 +109,7 @@ def cluster_connected(hacluster):
 
 
 @reactive.when("identity-service.connected")
+@reactive.when_not(trilio_wlm.STATUS_CACHED_FLAG)
 def register_endpoints_and_request_notification(identity_service):
     """Register endpoints and request notification.
 
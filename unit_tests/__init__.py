@@ -1,5 +1,7 @@
 import sys
 
+import mock
+
 sys.path.append("src")
 sys.path.append("src/lib")
 
@@ -7,3 +9,14 @@ sys.path.append("src/lib")
 import charms_openstack.test_mocks  # noqa
 
 charms_openstack.test_mocks.mock_charmhelpers()
+
+# Mock out keystoneauth1, used by the workloadmgr API client, keeping its
+# exceptions catchable.
+keystoneauth1 = mock.MagicMock()
+keystoneauth1.exceptions.ConnectFailure = type(
+    "ConnectFailure", (Exception,), {})
+sys.modules["keystoneauth1"] = keystoneauth1
+sys.modules["keystoneauth1.exceptions"] = keystoneauth1.exceptions
+sys.modules["keystoneauth1.session"] = keystoneauth1.session
+sys.modules["keystoneauth1.identity"] = keystoneauth1.identity
+sys.modules["keystoneauth1.identity.v3"] = keystoneauth1.identity.v3
@@ -0,0 +1,86 @@
+# Copyright 2020 Canonical Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import mock
+
+import charmhelpers.core.hookenv as hookenv
+
+import actions.actions as actions
+import charm.openstack.profiling as profiling
+import charm.openstack.trilio_wlm as trilio_wlm
+import charms_openstack.test_utils as test_utils
+
+
+class FakeSerial(object):
+    """Coordinator loading its state in the hook start callbacks."""
+
+    requests = None
+
+    def __init__(self, **kwargs):
+        hookenv.atstart(self.initialize)
+
+    @classmethod
+    def initialize(cls):
+        cls.requests = {}
+
+    def acquire(self, lock):
+        # fails as charmhelpers does when the hook start callbacks ran
+        # before the coordinator was created
+        self.requests[lock] = True
+        return True
+
+
+class TestMain(test_utils.PatchHelper):
+
+    def setUp(self):
+        super().setUp()
+        FakeSerial.requests = None
+        self.callbacks = []
+        self.patch_object(actions, "_bootstrap")
+        self.patch_object(profiling, "enable")
+        self.patch_object(profiling, "section", new=mock.MagicMock())
+        self.patch_object(
+            hookenv, "atstart", side_effect=self.callbacks.append)
+        self.patch_object(
+            hookenv, "_run_atstart",
+            side_effect=lambda: [f() for f in self.callbacks])
+        self.patch_object(hookenv, "_run_atexit")
+        self.patch_object(hookenv, "function_fail")
+        self.patch_object(trilio_wlm.coordinator, "Serial", new=FakeSerial)
+
+        # loading the charm module creates the restart coordinator
+        def import_module(name):
+            self.assertEqual(name, "charm.openstack.trilio_wlm")
+            trilio_wlm.restart_coordinator()
+
+        self.patch_object(
+            actions.importlib, "import_module", side_effect=import_module)
+
+    def test_acquire_restart_lock(self):
+        acquired = []
+
+        def action(args):
+            acquired.append(trilio_wlm.restart_coordinator().acquire(
+                trilio_wlm.RESTART_LOCK))
+
+        with mock.patch.dict(actions.ACTIONS, {"update-trilio": action}):
+            actions.main(["actions/update-trilio"])
+        self.function_fail.assert_not_called()
+        self.assertEqual(acquired, [True])
+        self._run_atexit.assert_called_once_with()
+
+    def test_undefined_action(self):
+        self.assertEqual(
+            actions.main(["actions/unknown"]), "Action unknown undefined")
+        self._run_atstart.assert_not_called()
@@ -0,0 +1,106 @@
+# Copyright 2020 Canonical Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import tempfile
+import unittest
+
+import files.s3_cache_evict as s3_cache_evict
+
+
+class TestS3CacheEvict(unittest.TestCase):
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.cache_dir = os.path.join(tmp.name, "cache")
+        self.state_file = os.path.join(tmp.name, "stats.json")
+        os.makedirs(os.path.join(self.cache_dir, "bucket"))
+
+    def _object(self, name, size, atime, mtime=1000):
+        path = os.path.join(self.cache_dir, "bucket", name)
+        with open(path, "wb") as f:
+            f.write(b"\0" * size)
+        os.utime(path, (atime, mtime))
+        return path
+
+    def _run(self, now, atime="strictatime"):
+        return s3_cache_evict.run(
+            self.cache_dir, 1000, self.state_file, now=now, atime=atime)
+
+    def test_under_max_size(self):
+        self._object("a", 100, 1000)
+        state = self._run(2000)
+        self.assertEqual(state["objects"], 1)
+        self.assertEqual(state["size"], 100)
+        self.assertEqual(state["evicted-objects"], 0)
+        self.assertNotIn("hits", state)
+        self.assertEqual(s3_cache_evict.load_state(self.state_file), state)
+
+    def test_evict_least_recently_used(self):
+        oldest = self._object("a", 300, 1100)
+        old = self._object("b", 300, 1200)
+        recent = self._object("c", 700, 1300)
+        state = self._run(2000)
+        # evicted down to 90% of the maximum size
+        self.assertFalse(os.path.exists(oldest))
+        self.assertFalse(os.path.exists(old))
+        self.assertTrue(os.path.exists(recent))
+        self.assertEqual(state["evicted-objects"], 2)
+        self.assertEqual(state["evicted-bytes"], 600)
+        self.assertEqual(state["objects"], 1)
+        self.assertEqual(state["size"], 700)
+
+    def test_hits_and_misses(self):
+        self._object("a", 10, 1000)
+        self._run(2000)
+        # read again
+        self._object("a", 10, 2500)
+        # fetched from S3 for a read
+        self._object("b", 10, 2600, mtime=2500)
+        # written by a backup
+        self._object("c", 10, 2500, mtime=2500)
+        state = self._run(3000)
+        self.assertEqual((state["hits"], state["misses"]), (1, 1))
+        state = self._run(4000)
+        self.assertEqual((state["hits"], state["misses"]), (1, 1))
+
+    def test_relatime(self):
+        self._object("a", 10, 1000)
+        self._run(2000, atime="relatime")
+        self._object("a", 10, 2500)
+        state = self._run(3000, atime="relatime")
+        self.assertIsNone(state["hits"])
+        self.assertIsNone(state["misses"])
+        self.assertEqual(state["atime"], "relatime")
+        # counted once access times are reliable
+        state = self._run(4000)
+        self.assertEqual((state["hits"], state["misses"]), (0, 0))
+
+    def test_atime_mode(self):
+        mounts = os.path.join(os.path.dirname(self.state_file), "mounts")
+        with open(mounts, "w") as f:
+            f.write("/dev/sda1 / ext4 rw,relatime 0 0\n")
+        self.assertEqual(
+            s3_cache_evict.atime_mode(self.cache_dir, mounts), "relatime")
+        with open(mounts, "a") as f:
+            f.write("/dev/sda1 {} ext4 rw 0 0\n".format(
+                self.cache_dir.replace(" ", "\\040")))
+        self.assertEqual(
+            s3_cache_evict.atime_mode(self.cache_dir, mounts), "strictatime")
+        self.assertEqual(
+            s3_cache_evict.atime_mode(os.path.join(self.cache_dir, "bucket"),
+                                      mounts), "strictatime")
+        self.assertEqual(
+            s3_cache_evict.atime_mode(self.state_file, mounts), "relatime")
@@ -0,0 +1,56 @@
+# Copyright 2020 Canonical Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import tempfile
+import unittest
+
+import charm.openstack.benchmark as benchmark
+
+
+class TestBenchmark(unittest.TestCase):
+
+    # small enough to run quickly against a local directory standing in
+    # for the mounted backup target
+    _options = benchmark.Options(
+        file_size=1024 * 1024, block_size=64 * 1024, random_block_size=4096,
+        random_ops=20, metadata_files=10, streams=3)
+
+    def test_percentile(self):
+        latencies = [float(i) for i in range(1, 101)]
+        self.assertEqual(benchmark.percentile(latencies, 50), 50.0)
+        self.assertEqual(benchmark.percentile(latencies, 99), 99.0)
+        self.assertEqual(benchmark.percentile([3.0], 99), 3.0)
+        self.assertEqual(benchmark.percentile([], 50), 0.0)
+
+    def test_run(self):
+        with tempfile.TemporaryDirectory() as target:
+            results = benchmark.run(target, self._options)
+            self.assertEqual(os.listdir(target), [])
+        self.assertEqual(
+            list(results),
+            ["sequential-write", "sequential-read", "random-read",
+             "random-write", "metadata", "parallel-write"])
+        for name, result in results.items():
+            self.assertGreater(result.ops_per_sec, 0, name)
+            self.assertLessEqual(result.p50_ms, result.p99_ms, name)
+        self.assertIsNone(results["metadata"].throughput)
+        self.assertGreater(results["parallel-write"].throughput, 0)
+
+    def test_run_not_writable(self):
+        with tempfile.TemporaryDirectory() as target:
+            open(os.path.join(target, "file"), "w").close()
+            with self.assertRaises(OSError):
+                benchmark.run(
+                    os.path.join(target, "file", "share"), self._options)
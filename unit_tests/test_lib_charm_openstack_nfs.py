@@ -0,0 +1,109 @@
+# Copyright 2020 Canonical Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import tempfile
+import unittest
+
+import charm.openstack.nfs as nfs
+
+
+class TestNFSOptions(unittest.TestCase):
+
+    _defaults = "nolock,soft,timeo=180,intr,lookupcache=none"
+
+    def test_parse_format_roundtrip(self):
+        self.assertEqual(
+            nfs.format_options(nfs.parse_options(self._defaults)),
+            self._defaults)
+        self.assertEqual(nfs.format_options(nfs.parse_options(None)), "")
+
+    def test_profile(self):
+        self.assertEqual(
+            nfs.merge_options("throughput"),
+            "nconnect=8,rsize=1048576,wsize=1048576,noatime")
+        self.assertEqual(
+            nfs.merge_options("throughput,nconnect=4"),
+            "rsize=1048576,wsize=1048576,noatime,nconnect=4")
+
+    def test_merge_options(self):
+        self.assertEqual(
+            nfs.merge_options(self._defaults, "hard,timeo=600,rsize=65536"),
+            "nolock,intr,lookupcache=none,hard,timeo=600,rsize=65536")
+        self.assertEqual(
+            nfs.merge_options(self._defaults, ""), self._defaults)
+
+    def test_validate_options(self):
+        self.assertEqual(nfs.validate_options(self._defaults), [])
+        self.assertEqual(nfs.validate_options(
+            "throughput,vers=4.1,proto=tcp,sec=krb5"), [])
+        self.assertEqual(
+            nfs.validate_options(
+                "nolock=1,nconect=8,timeo=,rsize=1M,nconnect=32,"
+                "lookupcache=some"),
+            ["nolock takes no value",
+             "unknown option nconect",
+             "timeo requires a value",
+             "rsize must be an integer",
+             "nconnect must be between 1 and 16",
+             "lookupcache must be one of all, none, pos, positive"])
+
+    def test_valid_options(self):
+        self.assertEqual(nfs.valid_options(self._defaults), self._defaults)
+        self.assertEqual(
+            nfs.valid_options(
+                "nolock=1,fast,timeo=600,nconnect=32,throughput"),
+            "timeo=600,nconnect=8,rsize=1048576,wsize=1048576,noatime")
+
+    def test_parse_share_options(self):
+        self.assertEqual(nfs.parse_share_options(None), {})
+        self.assertEqual(
+            nfs.parse_share_options(
+                "10.40.3.20:/srv/tv: throughput\n"
+                "10.40.3.21:/srv/tv: rsize=65536\n"),
+            {"10.40.3.20:/srv/tv": "throughput",
+             "10.40.3.21:/srv/tv": "rsize=65536"})
+        for value in ("- throughput", "share: [a, b]", "share: {"):
+            with self.assertRaises(ValueError):
+                nfs.parse_share_options(value)
+
+
+class TestNFSClientTuning(unittest.TestCase):
+
+    def test_conf(self):
+        self.assertIn("vm.dirty_ratio = 10\n", nfs.sysctl_conf())
+        self.assertEqual(
+            nfs.modprobe_conf(),
+            "options sunrpc tcp_slot_table_entries=128 "
+            "tcp_max_slot_table_entries=128\n")
+        self.assertIn('ATTR{read_ahead_kb}="16384"', nfs.udev_rules())
+
+    def test_read_sysctl(self):
+        with tempfile.TemporaryDirectory() as proc_dir:
+            os.makedirs(os.path.join(proc_dir, "sys", "net", "ipv4"))
+            with open(os.path.join(
+                    proc_dir, "sys", "net", "ipv4", "tcp_rmem"), "w") as f:
+                f.write("4096\t87380\t16777216\n")
+            self.assertEqual(
+                nfs.read_sysctl("net.ipv4.tcp_rmem", proc_dir=proc_dir),
+                "4096 87380 16777216")
+            self.assertIsNone(nfs.read_sysctl(
+                "sunrpc.tcp_slot_table_entries", proc_dir=proc_dir))
+
+    def test_read_ahead_path(self):
+        dev = os.stat("/").st_dev
+        self.assertEqual(
+            nfs.read_ahead_path("/", sys_dir="/sysfs"),
+            "/sysfs/class/bdi/{}:{}/read_ahead_kb".format(
+                os.major(dev), os.minor(dev)))
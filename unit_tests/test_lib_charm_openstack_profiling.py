@@ -0,0 +1,147 @@
+# Copyright 2020 Canonical Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import collections
+import os
+import shutil
+import tempfile
+
+import mock
+
+import charms.reactive.bus as bus
+
+import charm.openstack.profiling as profiling
+import charms_openstack.test_utils as test_utils
+
+
+class FakeModule(object):
+
+    def relation_get(self, *args):
+        return self.render()
+
+    def render(self):
+        return "rendered"
+
+
+class TestProfiling(test_utils.PatchHelper):
+
+    def setUp(self):
+        super().setUp()
+        self.module = FakeModule()
+        self.patch_object(profiling.importlib, "import_module",
+                          return_value=self.module)
+        self.patch_object(profiling, "PHASES", new=collections.OrderedDict([
+            ("relation", [("fake", "relation_get")]),
+            ("template", [("fake", "render")]),
+        ]))
+        self.patch_object(profiling.hookenv, "config", return_value=None)
+        self.patch_object(profiling.hookenv, "atexit")
+        self.patch_object(profiling.hookenv, "log")
+        self.patch_object(profiling.hookenv, "hook_name",
+                          return_value="config-changed")
+        environ = mock.patch.dict(os.environ)
+        environ.start()
+        self.addCleanup(environ.stop)
+        os.environ.pop(profiling.ENV_VAR, None)
+        self.environ = os.environ
+        self.addCleanup(profiling.disable)
+
+    def test_mode(self):
+        self.assertIsNone(profiling.mode())
+        self.config.return_value = "timing"
+        self.assertEqual(profiling.mode(), profiling.TIMING)
+        self.environ[profiling.ENV_VAR] = "cprofile"
+        self.assertEqual(profiling.mode(), profiling.CPROFILE)
+        self.environ[profiling.ENV_VAR] = "off"
+        self.assertIsNone(profiling.mode())
+
+    def test_disabled(self):
+        self.assertIsNone(profiling.enable())
+        with profiling.section("render_config"):
+            self.assertEqual(self.module.relation_get(), "rendered")
+        self.assertEqual(vars(self.module), {})
+        self.atexit.assert_not_called()
+
+    def test_phases(self):
+        self.environ[profiling.ENV_VAR] = "timing"
+        profile = profiling.enable()
+        self.assertEqual(profile.name, "config-changed")
+        self.atexit.assert_called_once_with(profiling.disable)
+        self.assertIs(profiling.enable(), profile)
+        with profiling.section("render_config"):
+            self.assertEqual(self.module.relation_get("rid"), "rendered")
+            self.module.render()
+        self.module.render()
+        # render called from within relation_get counts as relation time
+        self.assertEqual(
+            {phase: t.calls
+             for phase, t in profile.phases["render_config"].items()},
+            {"relation": 1, "template": 1})
+        self.assertEqual(
+            profile.phases[profiling.FRAMEWORK_SECTION]["template"].calls, 1)
+        self.assertEqual(profile.sections["render_config"].calls, 1)
+        summary = profile.summary()
+        self.assertEqual(len(summary), 3)
+        self.assertTrue(summary[1].startswith("  render_config: "))
+        self.assertIn("relation", summary[1])
+        self.assertTrue(summary[2].startswith("  (framework) ["))
+
+    def test_handler_invoke(self):
+        self.environ[profiling.ENV_VAR] = "timing"
+        invoke = bus.Handler.invoke
+        profile = profiling.enable()
+        action = mock.MagicMock()
+        handler = mock.MagicMock(_action=action, _post_callbacks=[])
+        handler.id.return_value = "reactive/trilio_wlm_handlers.py:1:init_db"
+        handler._get_args.return_value = ["endpoint"]
+        bus.Handler.invoke(handler)
+        action.assert_called_once_with("endpoint")
+        self.assertEqual(
+            list(profile.sections),
+            ["reactive/trilio_wlm_handlers.py:1:init_db"])
+        profiling.disable()
+        self.assertIs(bus.Handler.invoke, invoke)
+        self.assertIsNone(profiling._profile)
+
+    def test_disable_restores_and_logs(self):
+        self.environ[profiling.ENV_VAR] = "timing"
+        relation_get = self.module.relation_get
+        profiling.enable()
+        self.assertIsNot(self.module.relation_get, relation_get)
+        profiling.disable()
+        self.assertEqual(self.module.relation_get, relation_get)
+        self.log.assert_called_once_with(
+            mock.ANY, level=profiling.hookenv.INFO)
+        self.assertTrue(
+            self.log.call_args[0][0].startswith("profile config-changed: "))
+
+    def test_cprofile_dump(self):
+        charm_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, charm_dir)
+        self.patch_object(profiling.hookenv, "charm_dir",
+                          return_value=charm_dir)
+        self.patch_object(profiling, "MAX_PROFILES", new=2)
+        profiles = os.path.join(charm_dir, profiling.PROFILES_DIR)
+        os.makedirs(profiles)
+        for i, name in enumerate(("old.prof", "older.prof")):
+            path = os.path.join(profiles, name)
+            open(path, "w").close()
+            os.utime(path, (i, i))
+        self.environ[profiling.ENV_VAR] = "cprofile"
+        profiling.enable("create-license")
+        profiling.disable()
+        dumps = sorted(os.listdir(profiles))
+        self.assertEqual(len(dumps), 2)
+        self.assertNotIn("old.prof", dumps)
+        self.assertTrue(any(d.startswith("create-license-") for d in dumps))
@@ -0,0 +1,86 @@
+# Copyright 2020 Canonical Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import tempfile
+import unittest
+
+import charm.openstack.systemd as systemd
+
+
+class TestSystemdResources(unittest.TestCase):
+
+    def test_dropin(self):
+        self.assertEqual(
+            systemd.dropin("wlm-api"),
+            "/etc/systemd/system/wlm-api.service.d/wlm-api-resources.conf")
+
+    def test_parse_overrides(self):
+        self.assertEqual(systemd.parse_overrides(None), {})
+        self.assertEqual(
+            systemd.parse_overrides(
+                "wlm-workloads: {CPUWeight: 50, MemoryMax: 90%}\n"),
+            {"wlm-workloads": {"CPUWeight": "50", "MemoryMax": "90%"}})
+        for value in ("- wlm-api", "wlm-api: 100", "wlm-api: {"):
+            with self.assertRaises(ValueError):
+                systemd.parse_overrides(value)
+
+    def test_validate_overrides(self):
+        self.assertEqual(systemd.validate_overrides({
+            "wlm-api": {"CPUWeight": "10000", "MemoryHigh": "4G",
+                        "MemoryMax": "infinity", "TasksMax": "50%"},
+        }), [])
+        self.assertEqual(
+            systemd.validate_overrides({
+                "nova-compute": {},
+                "wlm-api": {"CPUWeight": "0", "IOWeight": "high",
+                            "MemoryMax": "4GB", "TasksMax": "-1",
+                            "Nice": "10"},
+            }),
+            ["unknown service nova-compute",
+             "wlm-api: CPUWeight must be between 1 and 10000",
+             "wlm-api: IOWeight must be between 1 and 10000",
+             "wlm-api: MemoryMax must be a size, percentage or infinity",
+             "wlm-api: unknown setting Nice",
+             "wlm-api: TasksMax must be a number, percentage or infinity"])
+
+    def test_resources(self):
+        resources = systemd.resources(
+            {"wlm-workloads": {"CPUWeight": "50"}})
+        self.assertEqual(list(resources), list(systemd.DEFAULT_RESOURCES))
+        self.assertEqual(resources["wlm-workloads"]["CPUWeight"], "50")
+        self.assertEqual(resources["wlm-workloads"]["IOWeight"], "100")
+        self.assertEqual(
+            resources["wlm-api"], systemd.DEFAULT_RESOURCES["wlm-api"])
+
+    def test_memory_controller_unified(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "cgroup.controllers")
+            self.assertFalse(systemd.memory_controller_unified(path))
+            # hybrid hierarchy, memory still controlled through cgroup v1
+            with open(path, "w") as f:
+                f.write("\n")
+            self.assertFalse(systemd.memory_controller_unified(path))
+            with open(path, "w") as f:
+                f.write("cpuset cpu io memory pids\n")
+            self.assertTrue(systemd.memory_controller_unified(path))
+
+    def test_throttled_services(self):
+        self.assertEqual(
+            systemd.throttled_services(systemd.DEFAULT_RESOURCES),
+            ["wlm-workloads", "tvault-object-store"])
+        self.assertEqual(
+            systemd.throttled_services(systemd.resources(
+                {"wlm-workloads": {"MemoryHigh": "infinity"}})),
+            ["tvault-object-store"])
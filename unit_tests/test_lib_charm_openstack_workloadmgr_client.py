@@ -0,0 +1,130 @@
+# Copyright 2020 Canonical Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import unittest
+
+import mock
+
+import charm.openstack.workloadmgr_client as workloadmgr_client
+
+
+class FakeResponse(object):
+
+    def __init__(self, status_code, body):
+        self.status_code = status_code
+        self.text = json.dumps(body)
+        self.content = self.text.encode()
+
+    def json(self):
+        return json.loads(self.text)
+
+
+class FakeSession(object):
+    """Replay queued responses and record received requests"""
+
+    def __init__(self, responses):
+        self.responses = list(responses)
+        self.requests = []
+
+    def request(self, url, method, raise_exc=True, **kwargs):
+        self.requests.append((method, url, kwargs.get("json")))
+        response = self.responses.pop(0)
+        if isinstance(response, Exception):
+            raise response
+        return FakeResponse(*response)
+
+
+class TestWorkloadMgrClient(unittest.TestCase):
+
+    _endpoint = "http://10.5.0.10:8780/v1/project-id"
+
+    def _client(self, responses, **kwargs):
+        self.session = FakeSession(responses)
+        kwargs.setdefault("backoff", 0)
+        return workloadmgr_client.WorkloadMgrClient(
+            self.session, self._endpoint + "/", **kwargs)
+
+    def test_create_trust(self):
+        client = self._client([(200, {"trust": [{"id": "trust-id"}]})])
+        self.assertEqual(
+            client.create_trust("Admin", is_cloud_trust=True),
+            {"trust": [{"id": "trust-id"}]})
+        self.assertEqual(self.session.requests, [
+            ("POST", self._endpoint + "/trusts",
+             {"trusts": {"role_name": "Admin", "is_cloud_trust": True}}),
+        ])
+
+    def test_create_license(self):
+        client = self._client([(200, {"license": {}})])
+        client.create_license("license-text")
+        self.assertEqual(self.session.requests, [
+            ("POST", self._endpoint + "/workloads/license",
+             {"license": {"lic_txt": "license-text"}}),
+        ])
+
+    def test_retry_transient_errors(self):
+        client = self._client([
+            (503, {"error": "unavailable"}),
+            (429, {"error": "too many requests"}),
+            (200, {"trust": []}),
+        ])
+        self.assertEqual(client.create_trust("Admin"), {"trust": []})
+        self.assertEqual(len(self.session.requests), 3)
+
+    def test_no_post_retry_gateway_error(self):
+        # the API may have created the trust behind the failing proxy
+        for status in (502, 504):
+            client = self._client([(status, {"error": "gateway"})])
+            with self.assertRaises(
+                    workloadmgr_client.WorkloadMgrAPIError) as e:
+                client.create_trust("Admin")
+            self.assertEqual(e.exception.status_code, status)
+            self.assertEqual(len(self.session.requests), 1)
+
+    def test_retry_gateway_error_idempotent(self):
+        client = self._client([(502, {}), (200, {"trusts": []})])
+        self.assertEqual(client._request("GET", "/trusts"), {"trusts": []})
+        self.assertEqual(len(self.session.requests), 2)
+
+    def test_retry_exhausted(self):
+        client = self._client([(503, {"error": "unavailable"})] * 4)
+        with self.assertRaises(workloadmgr_client.WorkloadMgrAPIError) as e:
+            client.create_trust("Admin")
+        self.assertEqual(e.exception.status_code, 503)
+        self.assertEqual(len(self.session.requests), 4)
+
+    def test_no_retry_client_error(self):
+        client = self._client([(400, {"error": "bad request"})])
+        with self.assertRaises(workloadmgr_client.WorkloadMgrAPIError) as e:
+            client.create_trust("Admin")
+        self.assertEqual(e.exception.status_code, 400)
+        self.assertEqual(len(self.session.requests), 1)
+
+    def test_retry_connect_failure(self):
+        failure = workloadmgr_client.ks_exceptions.ConnectFailure
+        client = self._client([failure("refused")] * 3, retries=2)
+        with self.assertRaises(failure):
+            client.create_trust("Admin")
+        self.assertEqual(len(self.session.requests), 3)
+
+    def test_backoff_bounded(self):
+        client = self._client(
+            [(503, {})] * 3 + [(200, {})], retries=3, backoff=4,
+            max_backoff=5)
+        with mock.patch.object(
+                workloadmgr_client.time, "sleep") as sleep:
+            client.create_trust("Admin")
+        self.assertEqual(
+            [c[0][0] for c in sleep.call_args_list], [4, 5, 5])
@@ -105,11 +105,18 @@ class TestDmapiHandlers(test_utils.PatchHelper):
                 "amqp.available",
             ),
             "init_db": ("config.rendered",),
+            "run_pending_restarts": ("restart.pending",),
             "cluster_connected": ("ha.connected",),
             "register_endpoints_and_request_notification": (
                 "identity-service.connected",),
         }
-        when_not_patterns = {}
+        when_not_patterns = {
+            "render_config": ("trilio-wlm.status-cached",),
+            "init_db": ("trilio-wlm.status-cached",),
+            "cluster_connected": ("trilio-wlm.status-cached",),
+            "register_endpoints_and_request_notification": (
+                "trilio-wlm.status-cached",),
+        }
         # check the when hooks are attached to the expected functions
         for t, p in [
             (_when_args, when_patterns),
@@ -138,9 +145,65 @@ class TestDmapiHandlers(test_utils.PatchHelper):
         args = "args"
         handlers.render_config(args)
         wlm_charm.upgrade_if_available.assert_called_once_with((args,))
+        wlm_charm.build_guestfs_appliance.assert_called_once_with()
         wlm_charm.render_with_interfaces.assert_called_once_with((args,))
+        wlm_charm.mount_nfs_shares.assert_called_once_with()
+        wlm_charm.configure_filesearch_limits.assert_called_once_with()
+        wlm_charm.configure_nfs_client_tuning.assert_called_once_with()
+        wlm_charm.configure_s3_cache.assert_called_once_with()
+        wlm_charm.assess_status.assert_called_once_with()
+
+    def test_run_pending_restarts(self):
+        wlm_charm = mock.MagicMock()
+        self.patch_object(
+            handlers.charm, "provide_charm_instance", new=mock.MagicMock()
+        )
+        self.provide_charm_instance().__enter__.return_value = wlm_charm
+        self.provide_charm_instance().__exit__.return_value = None
+        handlers.run_pending_restarts()
+        wlm_charm.run_pending_restarts.assert_called_once_with()
+
+    def test_leader_settings_changed(self):
+        wlm_charm = mock.MagicMock()
+        self.patch_object(
+            handlers.charm, "provide_charm_instance", new=mock.MagicMock()
+        )
+        self.provide_charm_instance().__enter__.return_value = wlm_charm
+        self.provide_charm_instance().__exit__.return_value = None
+        handlers.leader_settings_changed()
+        wlm_charm.db_sync.assert_called_once_with()
+
+    def test_update_status_cached(self):
+        wlm_charm = mock.MagicMock()
+        self.patch_object(
+            handlers.charm, "provide_charm_instance", new=mock.MagicMock()
+        )
+        self.provide_charm_instance().__enter__.return_value = wlm_charm
+        self.provide_charm_instance().__exit__.return_value = None
+        self.patch_object(handlers.trilio_wlm, "set_cached_status",
+                          return_value=True)
+        handlers.update_status()
+        wlm_charm.application_version_set.assert_called_once_with()
+        wlm_charm.assess_status.assert_not_called()
+
+    def test_update_status(self):
+        wlm_charm = mock.MagicMock()
+        self.patch_object(
+            handlers.charm, "provide_charm_instance", new=mock.MagicMock()
+        )
+        self.provide_charm_instance().__enter__.return_value = wlm_charm
+        self.provide_charm_instance().__exit__.return_value = None
+        self.patch_object(handlers.trilio_wlm, "set_cached_status",
+                          return_value=False)
+        handlers.update_status()
+        wlm_charm.application_version_set.assert_called_once_with()
         wlm_charm.assess_status.assert_called_once_with()
 
+    def test_invalidate_config_snapshot(self):
+        self.patch_object(handlers.trilio_wlm, "invalidate_config_snapshot")
+        handlers.invalidate_config_snapshot()
+        self.invalidate_config_snapshot.assert_called_once_with()
+
     def test_register_endpoints_and_request_notification(self):
         wlm_charm = mock.MagicMock()
         _service_type = "workloadmgr"